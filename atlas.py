@@ -0,0 +1,133 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from png_output import MAX_PALETTE_COLORS, encode_png, merge_palettes, rgba_palette
+from sprite_export import next_power_of_two
+
+
+def _shelf_pack(sizes, order, page_width, max_size, padding):
+    placements = [None] * len(sizes)
+    pages = []  # [used_width, used_height] per page
+    shelf_x = shelf_y = shelf_height = 0
+
+    for i in order:
+        padded_w, padded_h = sizes[i][0] + padding, sizes[i][1] + padding
+
+        if not pages:
+            pages.append([0, 0])
+        elif shelf_x + padded_w > page_width:
+            # Open a new shelf below the current one
+            shelf_y += shelf_height
+            shelf_x = shelf_height = 0
+
+        if shelf_y + padded_h > max_size:
+            # Page is full
+            pages.append([0, 0])
+            shelf_x = shelf_y = shelf_height = 0
+
+        placements[i] = (len(pages) - 1, shelf_x, shelf_y)
+        shelf_x += padded_w
+        shelf_height = max(shelf_height, padded_h)
+
+        page = pages[-1]
+        page[0] = max(page[0], shelf_x)
+        page[1] = max(page[1], shelf_y + shelf_height)
+
+    page_sizes = [(next_power_of_two(used_w), next_power_of_two(used_h)) for used_w, used_h in pages]
+    return placements, page_sizes
+
+
+def pack_rects(sizes, max_size=2048, padding=0):
+    # Shelf packing: rectangles sorted by height are laid out left to right in rows,
+    # a new row opening below the previous one and a new page when a page is full.
+    # Every power-of-two shelf width up to max_size is tried and the layout with the
+    # smallest total page area wins, so small atlases stay roughly square.
+    # Returns (page, x, y) for every rectangle and the power-of-two size of each page.
+    if not sizes:
+        return [], []
+    for w, h in sizes:
+        if w + padding > max_size or h + padding > max_size:
+            raise ValueError(f"Tile of {w}x{h} does not fit in a {max_size}x{max_size} page")
+
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+
+    best = None
+    page_width = next_power_of_two(max(w for w, _ in sizes) + padding)
+    while True:
+        placements, page_sizes = _shelf_pack(sizes, order, min(page_width, max_size), max_size, padding)
+        # Ties go to the squarer layout
+        score = (sum(w * h for w, h in page_sizes), max(max(size) for size in page_sizes))
+        if best is None or score < best[0]:
+            best = (score, placements, page_sizes)
+        if page_width >= max_size:
+            break
+        page_width *= 2
+    return best[1], best[2]
+
+
+def packing_efficiency(sizes, page_sizes):
+    # Share of the atlas area covered by tiles
+    used = sum(w * h for w, h in sizes)
+    total = sum(w * h for w, h in page_sizes)
+    return used / total if total else 0.0
+
+
+def build_atlas(sprites, max_size=2048, padding=0):
+    # sprites: (name, tiles (N, h, w, 4) RGBA, durations in ms or None) tuples.
+    # Returns the page arrays and a JSON-ready index of pixel and UV rectangles.
+    sizes = []
+    owners = []
+    for sprite_idx, (_, tiles, _) in enumerate(sprites):
+        h, w = tiles.shape[1:3]
+        sizes.extend([(w, h)] * len(tiles))
+        owners.extend((sprite_idx, frame_idx) for frame_idx in range(len(tiles)))
+
+    placements, page_sizes = pack_rects(sizes, max_size, padding)
+
+    pages = [np.zeros((page_h, page_w, 4), dtype=np.uint8) for page_w, page_h in page_sizes]
+    index = {
+        "pages": [{"width": page_w, "height": page_h} for page_w, page_h in page_sizes],
+        "sprites": {name: {"frames": [None] * len(tiles)} for name, tiles, _ in sprites},
+    }
+
+    for (sprite_idx, frame_idx), (page_idx, x, y), (w, h) in zip(owners, placements, sizes):
+        name, tiles, durations = sprites[sprite_idx]
+        pages[page_idx][y:y + h, x:x + w] = tiles[frame_idx]
+
+        page_w, page_h = page_sizes[page_idx]
+        entry = {
+            "page": page_idx,
+            "x": x, "y": y, "w": w, "h": h,
+            "uv": [x / page_w, y / page_h, (x + w) / page_w, (y + h) / page_h],
+        }
+        if durations is not None:
+            entry["duration"] = durations[frame_idx]
+        index["sprites"][name]["frames"][frame_idx] = entry
+
+    index["efficiency"] = packing_efficiency(sizes, page_sizes)
+    return pages, index
+
+
+def write_atlas(output_base, pages, index, indexed=False, compress_level=None, png_strategy='default'):
+    # Pages are written as <output_base>_<n>.png next to <output_base>.json. Indexed
+    # pages share one palette when their colours fit in it
+    output_base = Path(output_base)
+    output_base.parent.mkdir(parents=True, exist_ok=True)
+
+    palette = None
+    if indexed:
+        palette = merge_palettes([rgba_palette(page) for page in pages])
+        if len(palette) > MAX_PALETTE_COLORS:
+            palette = None
+
+    for page_idx, page in enumerate(pages):
+        page_path = output_base.with_name(f"{output_base.name}_{page_idx}.png")
+        encode_png(page, str(page_path), indexed, palette, compress_level, png_strategy)
+        index["pages"][page_idx]["file"] = page_path.name
+
+    index_path = output_base.with_name(output_base.name + ".json")
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    return index_path
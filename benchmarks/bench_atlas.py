@@ -0,0 +1,64 @@
+import argparse
+import time
+
+import numpy as np
+
+from atlas import pack_rects, packing_efficiency
+from sprite_export import next_power_of_two
+
+
+def synthetic_sizes(count, seed=0, min_size=8, max_size=96):
+    # Mix of sprite tile sizes, as produced by GIFs with different selections
+    rng = np.random.default_rng(seed)
+    return [tuple(int(v) for v in size) for size in rng.integers(min_size, max_size + 1, (count, 2))]
+
+
+def strip_page_sizes(sizes, max_size):
+    # Area one power-of-two padded sprite sheet per tile size would take: each
+    # distinct size becomes a horizontal strip, the way export_sprite_sheet lays them out
+    pages = []
+    for w, h in set(sizes):
+        count = sizes.count((w, h))
+        per_row = max(1, max_size // w)
+        rows = -(-count // per_row)
+        pages.append((next_power_of_two(w * min(count, per_row)), next_power_of_two(h * rows)))
+    return pages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark texture atlas packing "
+                    "(run from the repository root with python -m benchmarks.bench_atlas).")
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--max-size", type=int, default=2048)
+    parser.add_argument("--padding", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'tiles':>6} {'pages':>6} {'pack ms':>9} {'atlas eff':>10} {'strips eff':>11}")
+    for count in args.counts:
+        sizes = synthetic_sizes(count)
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            placements, page_sizes = pack_rects(sizes, args.max_size, args.padding)
+            best = min(best, time.perf_counter() - start)
+
+        # No two rectangles on a page may overlap
+        for page_idx in range(len(page_sizes)):
+            page_w, page_h = page_sizes[page_idx]
+            covered = np.zeros((page_h, page_w), dtype=np.uint8)
+            for (page, x, y), (w, h) in zip(placements, sizes):
+                if page == page_idx:
+                    covered[y:y + h, x:x + w] += 1
+            if covered.max() > 1:
+                raise SystemExit(f"Overlapping tiles on page {page_idx} with {count} tiles")
+
+        atlas_eff = packing_efficiency(sizes, page_sizes)
+        strips_eff = packing_efficiency(sizes, strip_page_sizes(sizes, args.max_size))
+        print(f"{count:>6} {len(page_sizes):>6} {best * 1000:>9.1f} {atlas_eff:>10.1%} {strips_eff:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from render_cache import checkerboard, composite_keyed
+
+
+def legacy_preview(frame_rgba, bg_size=20):
+    # The previous nested-loop ImageDraw checkerboard plus PIL paste
+    img = Image.fromarray(frame_rgba, 'RGBA')
+    bg_img = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    dc = ImageDraw.Draw(bg_img)
+    for i in range(0, img.width, bg_size):
+        for j in range(0, img.height, bg_size):
+            color = (200, 200, 200) if ((i + j) // bg_size) % 2 == 0 else (150, 150, 150)
+            dc.rectangle([i, j, i + bg_size, j + bg_size], fill=color)
+    bg_img.paste(img, (0, 0), img)
+    return np.array(bg_img)[..., :3]
+
+
+def vectorized_preview(frame_rgb, alpha):
+    h, w = frame_rgb.shape[:2]
+    return composite_keyed(frame_rgb, alpha, checkerboard(w, h))
+
+
+def synthetic_frame(size, seed=0):
+    # Random colours with roughly a third of the pixels keyed out
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    frame[..., 3] = np.where(rng.random((size, size)) < 0.33, 0, 255)
+    return frame
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the transparency preview checkerboard "
+                    "(run from the repository root with python -m benchmarks.bench_checkerboard).")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 2048])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6} {'legacy ms':>10} {'cold ms':>9} {'cached ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        frame = synthetic_frame(size)
+        frame_rgb, alpha = np.ascontiguousarray(frame[..., :3]), np.ascontiguousarray(frame[..., 3])
+        if not np.array_equal(legacy_preview(frame), vectorized_preview(frame_rgb, alpha)):
+            raise SystemExit(f"Vectorized preview differs from the legacy one at {size}x{size}")
+
+        legacy_time = best_time(lambda: legacy_preview(frame), args.repeat)
+
+        def cold():
+            checkerboard.cache_clear()
+            vectorized_preview(frame_rgb, alpha)
+
+        cold_time = best_time(cold, args.repeat)
+        vectorized_preview(frame_rgb, alpha)
+        cached_time = best_time(lambda: vectorized_preview(frame_rgb, alpha), args.repeat)
+
+        print(f"{size:>6} {legacy_time * 1000:>10.1f} {cold_time * 1000:>9.1f} "
+              f"{cached_time * 1000:>10.1f} {legacy_time / cached_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
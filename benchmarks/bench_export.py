@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import numpy as np
+
+from sprite_export import build_sprite_sheet, full_frame_selection
+
+
+def synthetic_frames(num_frames, size, pixel_size, seed=0):
+    # Blocky BGRA frames with some pure black pixels so the alpha keying has work to do
+    rng = np.random.default_rng(seed)
+    blocks = size // pixel_size
+    small = rng.integers(0, 4, (num_frames, blocks, blocks, 4), dtype=np.uint8) * 85
+    small[..., 3] = 255
+    return np.repeat(np.repeat(small, pixel_size, axis=1), pixel_size, axis=2)
+
+
+def time_call(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the per-frame and batched sprite-sheet export paths "
+                    "(run from the repository root with python -m benchmarks.bench_export).")
+    parser.add_argument("--frames", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--size", type=int, default=96, help="Source frame width and height")
+    parser.add_argument("--pixel-size", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'frames':>7} {'loop ms':>10} {'batched list ms':>16} {'batched array ms':>17} {'speedup':>8}")
+    for num_frames in args.frames:
+        stack = synthetic_frames(num_frames, args.size, args.pixel_size)
+        frame_list = list(stack)
+        selection_start, selection_end = full_frame_selection(stack.shape[1:], args.pixel_size, 0, 0)
+
+        def run(frames, batched):
+            return build_sprite_sheet(frames, selection_start, selection_end, args.pixel_size,
+                                      batched=batched)[0]
+
+        loop_time, expected = time_call(lambda: run(frame_list, False), args.repeat)
+        list_time, from_list = time_call(lambda: run(frame_list, True), args.repeat)
+        array_time, from_array = time_call(lambda: run(stack, True), args.repeat)
+
+        if not (np.array_equal(expected, from_list) and np.array_equal(expected, from_array)):
+            raise SystemExit(f"Batched output differs from the per-frame loop at {num_frames} frames")
+
+        print(f"{num_frames:>7} {loop_time * 1000:>10.1f} {list_time * 1000:>16.1f} "
+              f"{array_time * 1000:>17.1f} {loop_time / list_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from color_key import palettize, save_keyed_gif
+from gif_encoder import encode_keyed_gif
+
+KEY_BGR = (0, 255, 0)
+
+
+def synthetic_frames(num_frames, size, sprite_size, num_colors=48, seed=0):
+    # A paletted sprite moving over a key-coloured background, hidden every few frames
+    # and held still for others, as in a typical green-screen animation (BGR frames)
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 200, (num_colors, 3), dtype=np.uint8)
+    sprite = palette[rng.integers(0, num_colors, (sprite_size, sprite_size))]
+    travel = size - sprite_size
+
+    frames = []
+    for index in range(num_frames):
+        if index % 6 == 5:
+            frames.append(frames[-1])
+            continue
+        frame = np.empty((size, size, 3), dtype=np.uint8)
+        frame[...] = KEY_BGR
+        if index % 9 != 4:
+            x = (index * 5) % travel
+            y = (index * 3) % travel
+            frame[y:y + sprite_size, x:x + sprite_size] = sprite
+        frames.append(frame)
+    return frames
+
+
+def check_decoded(path, frames, durations):
+    # Every source frame, looked up by its start time, must show keyed pixels as
+    # transparent and all other pixels unchanged
+    with Image.open(path) as gif:
+        decoded = []
+        starts = []
+        elapsed = 0
+        for frame in ImageSequence.Iterator(gif):
+            decoded.append(np.array(frame.convert('RGBA')))
+            starts.append(elapsed)
+            elapsed += frame.info.get("duration", 0)
+
+    start = 0
+    for frame, duration in zip(frames, durations):
+        shown = decoded[np.searchsorted(starts, start, side='right') - 1]
+        keyed = (frame == KEY_BGR).all(axis=-1)
+        if (shown[..., 3] != np.where(keyed, 0, 255)).any():
+            return False
+        if not np.array_equal(shown[..., :3][~keyed], frame[..., ::-1][~keyed]):
+            return False
+        start += duration
+    return True
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the optimized keyed GIF encoder against full-frame imageio output "
+                    "(run from the repository root with python -m benchmarks.bench_gif_encoder).")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output",
+                        help="Keep the optimized GIF of the last size here instead of a temporary file")
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6} {'legacy KB':>10} {'legacy ms':>10} {'new KB':>9} {'new ms':>9} "
+          f"{'size':>7} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        output_path = args.output or os.path.join(scratch_dir, "bench_gif_encoder.gif")
+        for size in args.sizes:
+            frames = synthetic_frames(args.frames, size, size // 4)
+            indexed = [palettize(frame) for frame in frames]
+            durations = [40 + 20 * (index % 3) for index in range(len(frames))]
+            colors = [KEY_BGR]
+
+            def legacy():
+                buffer = io.BytesIO()
+                save_keyed_gif(indexed, buffer, colors, durations)
+                return buffer.tell()
+
+            legacy_time, legacy_bytes = best_time(legacy, args.repeat)
+            new_time, stats = best_time(
+                lambda: encode_keyed_gif(indexed, output_path, colors, durations), args.repeat)
+            if not check_decoded(output_path, frames, durations):
+                raise SystemExit(f"Optimized GIF does not decode to the keyed frames at {size}x{size}")
+
+            print(f"{size:>6} {legacy_bytes / 1024:>10.1f} {legacy_time * 1000:>10.1f} "
+                  f"{stats['bytes'] / 1024:>9.1f} {new_time * 1000:>9.1f} "
+                  f"{stats['bytes'] / legacy_bytes:>6.0%} {legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.suite import KEY_RGB, PIXEL_SIZE, make_fixture
+from color_key import save_keyed_gif
+from frame_source import GifFrameSource
+from gif_encoder import save_optimized_gif
+from sprite_export import export_keyed_sprite_sheet, export_sprite_sheet, full_frame_selection
+
+KEY_BGR = KEY_RGB[::-1]
+
+
+def _export(path, output_path, selection):
+    # The pixelation tool's export of a GIF, black pixels becoming transparent
+    source = GifFrameSource(path, mode='BGRA', cache_size=0)
+    try:
+        export_sprite_sheet(source, output_path, *selection, PIXEL_SIZE, durations=source.durations)
+    finally:
+        source.close()
+
+
+def legacy_round_trip(path, scratch_dir, selection):
+    # Transparency tool writing keyed pixels as black, then the pixelation tool
+    intermediate = os.path.join(scratch_dir, "legacy.gif")
+    source = GifFrameSource(path, mode='BGR', cache_size=0)
+    try:
+        save_keyed_gif(source.iter_indexed(), intermediate, [KEY_BGR], source.durations)
+    finally:
+        source.close()
+    output_path = os.path.join(scratch_dir, "legacy.png")
+    _export(intermediate, output_path, selection)
+    return output_path
+
+
+def gif_round_trip(path, scratch_dir, selection):
+    # Transparency tool writing a GIF with real transparency, then the pixelation tool
+    intermediate = os.path.join(scratch_dir, "keyed.gif")
+    source = GifFrameSource(path, mode='BGR', cache_size=0)
+    try:
+        save_optimized_gif(source, intermediate, [KEY_BGR], source.durations)
+    finally:
+        source.close()
+    output_path = os.path.join(scratch_dir, "keyed.png")
+    _export(intermediate, output_path, selection)
+    return output_path
+
+
+def single_pass(path, scratch_dir, selection):
+    output_path = os.path.join(scratch_dir, "single_pass.png")
+    source = GifFrameSource(path, mode='BGRA', cache_size=0)
+    try:
+        export_keyed_sprite_sheet(source, output_path, *selection, PIXEL_SIZE, [KEY_BGR],
+                                  durations=source.durations)
+    finally:
+        source.close()
+    return output_path
+
+
+PIPELINES = (('legacy round trip', legacy_round_trip), ('GIF round trip', gif_round_trip),
+             ('single pass', single_pass))
+
+
+def load_sheet(path):
+    # RGBA sheet with every transparent pixel as transparent black
+    with Image.open(path) as img:
+        sheet = np.array(img.convert('RGBA'))
+    sheet[sheet[..., 3] == 0] = 0
+    return sheet
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark single-pass keyed sprite sheet export against keying to a GIF first "
+                    "and exporting that (run from the repository root with "
+                    "python -m benchmarks.bench_pipeline).")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--colors", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6} {'pipeline':<18} {'ms':>9} {'speedup':>8} {'black lost':>11} {'mismatched':>11}")
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for size in args.sizes:
+            path = os.path.join(scratch_dir, f"fixture-{size}.gif")
+            make_fixture(path, size, args.frames, args.colors, 'keyed', black=True)
+            with Image.open(path) as gif:
+                selection = full_frame_selection((gif.height, gif.width), PIXEL_SIZE, 0, 0)
+
+            timings = {}
+            sheets = {}
+            for name, pipeline in PIPELINES:
+                timings[name], output_path = best_time(
+                    lambda: pipeline(path, scratch_dir, selection), args.repeat)
+                sheets[name] = load_sheet(output_path)
+
+            # Opaque black sprite pixels that a pipeline turned transparent, and any other
+            # pixel that differs from the single-pass sheet
+            reference = sheets['single pass']
+            black = (reference[..., 3] == 255) & ~reference[..., :3].any(axis=-1)
+            for name, _ in PIPELINES:
+                sheet = sheets[name]
+                lost = int((black & (sheet[..., 3] == 0)).sum())
+                mismatched = int(((sheet != reference).any(axis=-1) & ~black).sum())
+                print(f"{size:>6} {name:<18} {timings[name] * 1000:>9.1f} "
+                      f"{timings['legacy round trip'] / timings[name]:>7.1f}x "
+                      f"{lost:>11} {mismatched:>11}")
+
+            if (sheets['single pass'][..., 3] == 0).sum() == 0 or not black.any():
+                raise SystemExit(f"Fixture at {size}x{size} has nothing keyed or no black pixels")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import time
+
+import numpy as np
+
+from block_reduce import REDUCERS
+from sprite_export import build_sprite_sheet
+
+
+def synthetic_frames(num_frames, size, pixel_size, seed=0):
+    # A static sprite of flat colour patches with some texture, shifted by up to a
+    # block in each frame: the sub-block motion that makes nearest sampling flicker
+    rng = np.random.default_rng(seed)
+    # Patch edges deliberately do not line up with the block grid
+    patch = pixel_size * 3 + pixel_size // 2 + 1
+    base_size = size + pixel_size
+    cells = base_size // patch + 1
+    colours = rng.integers(0, 256, (cells, cells, 4), dtype=np.uint8)
+    colours[..., 3] = np.where(rng.random((cells, cells)) < 0.2, 0, 255)
+    base = np.repeat(np.repeat(colours, patch, axis=0), patch, axis=1)[:base_size, :base_size]
+    # Dithering-like texture from a few shades, as in a paletted GIF
+    noise = rng.choice([-8, 0, 0, 0, 8], base.shape[:2] + (1,))
+    base[..., :3] = np.clip(base[..., :3] + noise, 0, 255)
+
+    frames = np.empty((num_frames, size, size, 4), dtype=np.uint8)
+    shifts = rng.integers(0, pixel_size, (num_frames, 2))
+    for index, (dy, dx) in enumerate(shifts):
+        frames[index] = base[dy:dy + size, dx:dx + size]
+    return frames
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def flicker(sheet, num_frames):
+    # Mean absolute change of a sprite channel value between consecutive frames
+    tiles = sheet.reshape(num_frames, -1, sheet.shape[1], 4).astype(np.int16)
+    return np.abs(tiles[1:] - tiles[:-1]).mean()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the block reducers against nearest sampling "
+                    "(run from the repository root with python -m benchmarks.bench_reducers).")
+    parser.add_argument("--frames", type=int, default=1024)
+    parser.add_argument("--size", type=int, default=256, help="Frame width and height")
+    parser.add_argument("--pixel-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    frames = synthetic_frames(args.frames, args.size, args.pixel_size)
+    selection_end = (args.size - args.pixel_size, args.size - args.pixel_size)
+
+    print(f"{args.frames} frames of {args.size}x{args.size}, pixel size {args.pixel_size}")
+    print(f"{'reducer':>11} {'ms':>9} {'frames/s':>10} {'vs nearest':>11} {'flicker':>8}")
+    nearest_time = None
+    for reducer in REDUCERS:
+        elapsed, (sheet, num_frames) = best_time(
+            lambda: build_sprite_sheet(frames, (0, 0), selection_end, args.pixel_size, reducer=reducer),
+            args.repeat)
+        if nearest_time is None:
+            nearest_time = elapsed
+        print(f"{reducer:>11} {elapsed * 1000:>9.1f} {args.frames / elapsed:>10.0f} "
+              f"{elapsed / nearest_time:>10.1f}x {flicker(sheet, num_frames):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
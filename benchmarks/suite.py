@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image
+
+# Synthetic fixtures: (width and height, frames, palette colours, background). The
+# background is 'opaque' (textured, nothing to key), 'keyed' (flat green to key out)
+# or 'transparent' (the GIF's own transparent index)
+QUICK_CASES = [
+    (128, 32, 16, 'keyed'),
+    (256, 120, 64, 'keyed'),
+    (256, 120, 256, 'transparent'),
+    (512, 60, 256, 'opaque'),
+]
+FULL_CASES = QUICK_CASES + [
+    (1024, 60, 128, 'keyed'),
+    (512, 300, 32, 'transparent'),
+]
+
+STAGES = ('decode', 'indexed_decode', 'pixelate_preview', 'keyed_preview', 'export', 'keyed_export', 'save')
+
+KEY_RGB = (0, 255, 0)
+PIXEL_SIZE = 4
+
+
+def case_name(size, frames, colors, background):
+    return f"{size}px-{frames}f-{colors}c-{background}"
+
+
+def make_fixture(path, size, num_frames, num_colors, background, seed=0, black=False):
+    # Pixel art (4x4 blocks) sprites bouncing over the background, written with a
+    # fixed seed and fixed save options so every run gets the same file. black makes
+    # one sprite colour pure black
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (num_colors, 3), dtype=np.uint8)
+    palette[0] = KEY_RGB
+    if black:
+        palette[1] = 0
+    cells = size // PIXEL_SIZE
+
+    if background == 'opaque':
+        base = rng.integers(1, num_colors, (cells, cells), dtype=np.uint8)
+    else:
+        base = np.zeros((cells, cells), dtype=np.uint8)
+    sprites = [rng.integers(1, num_colors, (cells // 4, cells // 4), dtype=np.uint8) for _ in range(3)]
+    velocities = rng.integers(1, 4, (len(sprites), 2))
+
+    images = []
+    for index in range(num_frames):
+        canvas = base.copy()
+        for sprite, (vx, vy) in zip(sprites, velocities):
+            travel = cells - len(sprite)
+            x = abs((index * vx) % (2 * travel) - travel)
+            y = abs((index * vy) % (2 * travel) - travel)
+            canvas[y:y + len(sprite), x:x + len(sprite)] = sprite
+        pixels = np.repeat(np.repeat(canvas, PIXEL_SIZE, axis=0), PIXEL_SIZE, axis=1)
+        img = Image.fromarray(pixels, 'P')
+        img.putpalette(palette.tobytes())
+        images.append(img)
+
+    options = {"save_all": True, "append_images": images[1:], "loop": 0, "optimize": False,
+               "duration": [40 + 20 * (index % 3) for index in range(num_frames)]}
+    if background == 'transparent':
+        options.update(transparency=0, disposal=2)
+    images[0].save(path, **options)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _stage_setup(stage, path, scratch_dir):
+    # Everything a stage needs that is not part of what it measures. Returns
+    # (run function, number of frames it processes)
+    import cv2
+
+    from color_key import alpha_lut, key_lut, key_mask
+    from frame_source import GifFrameSource
+    from jobs import export_keyed_sprite_job, export_sprite_job, run_job, save_keyed_gif_job
+    from render_cache import display_size, grid_mask, render_keyed, render_pixelated
+    from sprite_export import full_frame_selection
+
+    probe = GifFrameSource(path, mode='BGR', cache_size=0)
+    num_frames, durations = len(probe), probe.durations
+    height, width = probe.height, probe.width
+    key_colors = [KEY_RGB[::-1]]
+    probe.close()
+
+    if stage == 'decode':
+        def run():
+            source = GifFrameSource(path, mode='BGRA', cache_size=0)
+            for _ in source:
+                pass
+            source.close()
+
+    elif stage == 'indexed_decode':
+        # Palette indices as the encoder reads them, palettizing RGB-decoded frames
+        def run():
+            source = GifFrameSource(path, mode='BGR', cache_size=0)
+            for _ in source.iter_indexed():
+                pass
+            source.close()
+
+    elif stage == 'pixelate_preview':
+        source = GifFrameSource(path, mode='BGRA', cache_size=0)
+        frames = list(source)
+        source.close()
+        grid = grid_mask(height, width, PIXEL_SIZE, 0, 0)
+        size = display_size(width, height)
+
+        def run():
+            for frame in frames:
+                render_pixelated(frame, PIXEL_SIZE, 0, 0, 'nearest', grid, size)
+
+    elif stage == 'keyed_preview':
+        # Nothing decoded is kept, so every frame costs what a preview cache miss does
+        source = GifFrameSource(path, mode='BGR', cache_size=0)
+
+        def run():
+            # As TransparencyTool.show_frame: paletted frames are keyed per palette
+            # entry, frames decoded to RGB per pixel
+            for index in range(num_frames):
+                entry = source.native_indexed(index)
+                if entry is not None:
+                    indices, palette = entry
+                    rgb_palette = np.ascontiguousarray(palette[:, ::-1])
+                    alpha_palette = alpha_lut(key_lut(palette, key_colors))
+                    render_keyed(rgb_palette[indices], alpha_palette[indices])
+                else:
+                    frame = source[index]
+                    render_keyed(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),
+                                 alpha_lut(key_mask(frame, key_colors)))
+
+    elif stage == 'export':
+        output_path = os.path.join(scratch_dir, "export.png")
+
+        def run():
+            source = GifFrameSource(path, mode='BGRA', cache_size=0)
+            selection_start, selection_end = full_frame_selection(source.shape, PIXEL_SIZE, 0, 0)
+            run_job(export_sprite_job, source, output_path, selection_start, selection_end, PIXEL_SIZE,
+                    durations=source.durations)
+            source.close()
+
+    elif stage == 'keyed_export':
+        output_path = os.path.join(scratch_dir, "keyed_export.png")
+
+        def run():
+            source = GifFrameSource(path, mode='BGRA', cache_size=0)
+            selection_start, selection_end = full_frame_selection(source.shape, PIXEL_SIZE, 0, 0)
+            run_job(export_keyed_sprite_job, source, output_path, selection_start, selection_end, PIXEL_SIZE,
+                    key_colors, durations=source.durations)
+            source.close()
+
+    elif stage == 'save':
+        output_path = os.path.join(scratch_dir, "save.gif")
+
+        def run():
+            source = GifFrameSource(path, mode='BGR', cache_size=0)
+            run_job(save_keyed_gif_job, source, output_path, key_colors, durations=durations)
+            source.close()
+
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return run, num_frames
+
+
+def run_stage(stage, path, repeat, scratch_dir):
+    # Runs in a fresh worker process, so the peak RSS belongs to this stage alone
+    baseline_rss = _peak_rss_mb()
+    run, num_frames = _stage_setup(stage, path, scratch_dir)
+    run()  # warm-up: imports, codec setup, lazily built tables
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    peak_rss = _peak_rss_mb()
+    return {
+        "frames": num_frames,
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "frames_per_s": num_frames / min(times),
+        "peak_rss_mb": peak_rss,
+        "rss_growth_mb": peak_rss - baseline_rss,
+    }
+
+
+def environment():
+    import cv2
+    import PIL
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def run_suite(cases, stages, repeat, fixture_dir):
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for size, num_frames, num_colors, background in cases:
+            name = case_name(size, num_frames, num_colors, background)
+            path = os.path.join(fixture_dir, name + ".gif")
+            if not os.path.exists(path):
+                make_fixture(path, size, num_frames, num_colors, background)
+
+            for stage in stages:
+                # A new spawned process per stage keeps imports, caches and memory apart
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(run_stage, stage, path, repeat, scratch_dir).result()
+                result.update(case=name, stage=stage, size=size, num_colors=num_colors,
+                              background=background)
+                results.append(result)
+                print(f"{name:<28} {stage:<17} {result['best_s'] * 1000:>9.1f} ms "
+                      f"{result['frames_per_s']:>9.0f} frames/s {result['peak_rss_mb']:>7.0f} MiB peak")
+    return results
+
+
+def compare(baseline, current, threshold, min_time_ms):
+    # Rows of (case, stage, baseline ms, current ms, time change, RSS change, regressed).
+    # A stage regresses when its best time or peak RSS grows by more than threshold;
+    # stages faster than min_time_ms are too noisy to judge on time
+    baseline_by_key = {(result["case"], result["stage"]): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        base = baseline_by_key.get((result["case"], result["stage"]))
+        if base is None:
+            continue
+        time_change = result["best_s"] / base["best_s"] - 1
+        rss_change = result["peak_rss_mb"] / base["peak_rss_mb"] - 1
+        slower = time_change > threshold and base["best_s"] * 1000 >= min_time_ms
+        regressed = slower or rss_change > threshold
+        rows.append((result["case"], result["stage"], base["best_s"] * 1000, result["best_s"] * 1000,
+                     time_change, rss_change, regressed))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"{'case':<28} {'stage':<17} {'base ms':>9} {'new ms':>9} {'time':>7} {'rss':>7}")
+    for case, stage, base_ms, new_ms, time_change, rss_change, regressed in rows:
+        print(f"{case:<28} {stage:<17} {base_ms:>9.1f} {new_ms:>9.1f} {time_change:>+7.0%} "
+              f"{rss_change:>+7.0%}{'  REGRESSION' if regressed else ''}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%} in {len(rows)} comparison(s)")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark decoding, previews, export and save of both tools on synthetic GIFs "
+                    "(run from the repository root with python -m benchmarks.suite).")
+    parser.add_argument("--full", action="store_true", help="Also run the larger fixtures")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fixtures", help="Directory to keep the generated GIFs in (default: temporary)")
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare with an earlier JSON result")
+    parser.add_argument("--results", metavar="CURRENT",
+                        help="With --compare, compare this JSON result instead of running the suite")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown or memory growth counted as a regression (default: 0.10)")
+    parser.add_argument("--min-time-ms", type=float, default=2.0,
+                        help="Ignore time changes of stages faster than this (default: 2)")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results needs --compare")
+        current = load_results(args.results)
+    else:
+        cases = FULL_CASES if args.full else QUICK_CASES
+        if args.fixtures:
+            os.makedirs(args.fixtures, exist_ok=True)
+            results = run_suite(cases, args.stages, args.repeat, args.fixtures)
+        else:
+            with tempfile.TemporaryDirectory() as fixture_dir:
+                results = run_suite(cases, args.stages, args.repeat, fixture_dir)
+        current = {"environment": environment(), "repeat": args.repeat, "results": results}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(current, f, indent=2)
+            print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        print()
+        regressions = print_comparison(compare(load_results(args.compare), current, args.threshold,
+                                               args.min_time_ms), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
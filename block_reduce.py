@@ -0,0 +1,112 @@
+import numpy as np
+
+from profiling import span
+
+# Ways of turning a pixel_size x pixel_size block into one output pixel
+REDUCERS = ('nearest', 'mean', 'median', 'mode', 'alpha_mean')
+
+
+def _crop_to_blocks(pixels, pixel_size):
+    rows, cols = pixels.shape[-3] // pixel_size, pixels.shape[-2] // pixel_size
+    return pixels[..., :rows * pixel_size, :cols * pixel_size, :]
+
+
+def _block_view(pixels, pixel_size):
+    # (..., H, W, C) -> (..., H/ps, W/ps, ps*ps, C) with every block's pixels on one axis
+    *lead, height, width, channels = pixels.shape
+    rows, cols = height // pixel_size, width // pixel_size
+    blocks = pixels.reshape(*lead, rows, pixel_size, cols, pixel_size, channels)
+    blocks = np.moveaxis(blocks, -4, -3)
+    return blocks.reshape(*lead, rows, cols, pixel_size * pixel_size, channels)
+
+
+def _block_sum(pixels, pixel_size, dtype):
+    # Sum every block, first over its rows (whole contiguous image rows added together)
+    # and then over its columns, which is several times faster than one multi-axis sum
+    *lead, height, width, channels = pixels.shape
+    rows, cols = height // pixel_size, width // pixel_size
+    row_sums = pixels.reshape(*lead, rows, pixel_size, width, channels).sum(axis=-3, dtype=dtype)
+    return row_sums.reshape(*lead, rows, cols, pixel_size, channels).sum(axis=-2, dtype=dtype)
+
+
+def _sum_dtype(pixel_size, max_value=255):
+    # uint16 is enough for blocks up to 16x16 of 8-bit values
+    return np.uint16 if pixel_size * pixel_size * max_value <= np.iinfo(np.uint16).max else np.uint32
+
+
+def _reduce_mean(pixels, pixel_size):
+    count = pixel_size * pixel_size
+    total = _block_sum(pixels, pixel_size, _sum_dtype(pixel_size)).astype(np.uint32)
+    return ((total + count // 2) // count).astype(np.uint8)
+
+
+def _reduce_median(pixels, pixel_size):
+    # Per-channel lower median, so even block sizes still give an existing channel value
+    blocks = _block_view(pixels, pixel_size)
+    middle = (blocks.shape[-2] - 1) // 2
+    return np.partition(blocks, middle, axis=-2)[..., middle, :]
+
+
+def _reduce_mode(pixels, pixel_size, chunk_blocks=1 << 16):
+    # Most frequent colour per block. Pixels are packed into one integer, sorted,
+    # and the longest run of equal values wins; ties go to the smallest packed value.
+    # Blocks are processed in chunks to bound the sort's temporary arrays
+    blocks = _block_view(pixels, pixel_size)
+    channels = blocks.shape[-1]
+    count = blocks.shape[-2]
+    packed = np.zeros(blocks.shape[:-1], dtype=np.uint32)
+    for channel in range(channels):
+        packed |= blocks[..., channel].astype(np.uint32) << (8 * channel)
+    packed = packed.reshape(-1, count)
+
+    positions = np.arange(count)
+    mode = np.empty(len(packed), dtype=np.uint32)
+    for start in range(0, len(packed), chunk_blocks):
+        chunk = np.sort(packed[start:start + chunk_blocks], axis=1)
+        run_start = np.zeros(chunk.shape, dtype=np.intp)
+        run_start[:, 1:] = np.where(chunk[:, 1:] != chunk[:, :-1], positions[1:], 0)
+        run_length = positions - np.maximum.accumulate(run_start, axis=1)
+        mode[start:start + len(chunk)] = chunk[np.arange(len(chunk)), run_length.argmax(axis=1)]
+
+    shifts = np.arange(channels, dtype=np.uint32) * 8
+    unpacked = (mode[:, None] >> shifts) & 0xFF
+    return unpacked.astype(np.uint8).reshape(blocks.shape[:-2] + (channels,))
+
+
+def _reduce_alpha_mean(pixels, pixel_size):
+    # Colour averaged with each pixel weighted by its alpha, so transparent pixels do
+    # not darken the edges; alpha itself is the plain mean
+    if pixels.shape[-1] != 4:
+        return _reduce_mean(pixels, pixel_size)
+    count = pixel_size * pixel_size
+    alpha = pixels[..., 3:]
+    weight = _block_sum(alpha, pixel_size, np.uint32)
+    colour = _block_sum(pixels[..., :3] * alpha.astype(np.uint16), pixel_size, np.uint32)
+    result = np.empty(weight.shape[:-1] + (4,), dtype=np.uint8)
+    result[..., :3] = (colour + weight // 2) // np.maximum(weight, 1)
+    result[..., 3:] = (weight + count // 2) // count
+    return result
+
+
+_REDUCER_FUNCS = {
+    'mean': _reduce_mean,
+    'median': _reduce_median,
+    'mode': _reduce_mode,
+    'alpha_mean': _reduce_alpha_mean,
+}
+
+
+def reduce_blocks(pixels, pixel_size, reducer='nearest'):
+    # Downsample a frame (H, W, C) or a whole stack (N, H, W, C) by pixel_size,
+    # one output pixel per complete block. 'nearest' keeps the top-left pixel
+    # of every block, exactly like cv2.resize with INTER_NEAREST
+    if reducer == 'nearest':
+        return _crop_to_blocks(pixels, pixel_size)[..., ::pixel_size, ::pixel_size, :]
+    try:
+        func = _REDUCER_FUNCS[reducer]
+    except KeyError:
+        raise ValueError(f"Unknown block reducer: {reducer}") from None
+    if pixel_size == 1:
+        return pixels.copy()
+    with span("block reduce"):
+        return func(_crop_to_blocks(pixels, pixel_size), pixel_size)
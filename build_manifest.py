@@ -0,0 +1,57 @@
+import json
+import os
+from pathlib import Path
+
+# Bump when export output changes so every entry is rebuilt
+MANIFEST_VERSION = 1
+
+DEFAULT_MANIFEST_NAME = ".choreosprite-build.json"
+
+
+def normalize_settings(settings):
+    # JSON round trip so tuples and lists compare equal to what was stored
+    return json.loads(json.dumps(settings, sort_keys=True))
+
+
+class BuildManifest:
+    # Records, for every exported sprite sheet, the hash of its source GIF and the
+    # settings it was built with, so reruns only rebuild outputs that are stale
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self.entries = data.get("outputs", {})
+
+    def is_fresh(self, output_path, source_hash, settings):
+        entry = self.entries.get(str(output_path))
+        if entry is None:
+            return False
+        if entry["source_hash"] != source_hash or entry["settings"] != normalize_settings(settings):
+            return False
+        # Outputs deleted or replaced since the last build are stale too
+        return os.path.exists(output_path) and os.path.exists(str(output_path) + ".mcmeta")
+
+    def record(self, output_path, source_path, source_hash, settings, elapsed):
+        self.entries[str(output_path)] = {
+            "source": str(source_path),
+            "source_hash": source_hash,
+            "settings": normalize_settings(settings),
+            "elapsed": elapsed,
+        }
+
+    def build_time(self, output_path):
+        entry = self.entries.get(str(output_path))
+        return entry["elapsed"] if entry else 0.0
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,123 @@
+import cv2
+import imageio
+import numpy as np
+
+from profiling import span
+from region_key import RegionKeyer
+
+# How the distance between a palette colour and a key colour is measured: largest
+# per-channel difference, Euclidean distance in RGB, or CIELAB Delta E (CIE76)
+KEY_METRICS = ('box', 'rgb', 'lab')
+
+
+def palettize(frame):
+    # Index the distinct colours of a frame: returns (indices, palette) with
+    # palette[indices] reproducing the frame
+    packed = ((frame[..., 0].astype(np.uint32) << 16) | (frame[..., 1].astype(np.uint32) << 8)
+              | frame[..., 2])
+    colors, indices = np.unique(packed.ravel(), return_inverse=True)
+    palette = np.stack([(colors >> 16) & 255, (colors >> 8) & 255, colors & 255], axis=1).astype(np.uint8)
+    index_dtype = np.uint8 if len(colors) <= 256 else np.uint32
+    return indices.reshape(frame.shape[:2]).astype(index_dtype), palette
+
+
+def _bgr_to_lab(bgr):
+    # (N, 3) uint8 BGR -> (N, 3) float32 L*a*b* with L in 0..100
+    bgr = np.asarray(bgr, dtype=np.float32).reshape(1, -1, 3) / 255
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+
+
+def key_lut(palette, colors, tolerance=5, metric='box'):
+    # Boolean table over palette entries that fall within tolerance of any key colour.
+    # 'box' compares per channel, matching cv2.inRange with clamped bounds
+    if metric not in KEY_METRICS:
+        raise ValueError(f"Unknown key metric: {metric}")
+    if not len(colors) or not len(palette):
+        return np.zeros(len(palette), dtype=bool)
+    if metric == 'box':
+        colors = np.asarray(colors, dtype=np.int16)
+        diff = np.abs(palette[:, None, :].astype(np.int16) - colors[None, :, :])
+        return (diff <= tolerance).all(axis=2).any(axis=1)
+
+    if metric == 'lab':
+        palette, colors = _bgr_to_lab(palette), _bgr_to_lab(colors)
+    else:
+        palette, colors = palette.astype(np.float32), np.asarray(colors, dtype=np.float32)
+    distance_sq = ((palette[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+    return (distance_sq <= tolerance * tolerance).any(axis=1)
+
+
+def key_mask(bgr, colors, tolerance=5, metric='box'):
+    # Per-pixel version of key_lut for a BGR image: (H, W) bool of keyed pixels. The box
+    # metric runs cv2.inRange per key colour; the others key the distinct colours once
+    if metric not in KEY_METRICS:
+        raise ValueError(f"Unknown key metric: {metric}")
+    if not len(colors) or not bgr.size:
+        return np.zeros(bgr.shape[:2], dtype=bool)
+    if metric == 'box':
+        bgr = np.ascontiguousarray(bgr)
+        mask = np.zeros(bgr.shape[:2], dtype=np.uint8)
+        for color in colors:
+            lower = np.clip(np.asarray(color, dtype=np.float64) - tolerance, 0, 255)
+            upper = np.clip(np.asarray(color, dtype=np.float64) + tolerance, 0, 255)
+            # Pixels are integers, so the float bounds round inwards
+            mask |= cv2.inRange(bgr, np.ceil(lower), np.floor(upper))
+        return mask != 0
+    indices, palette = palettize(bgr)
+    return key_lut(palette, colors, tolerance, metric)[indices]
+
+
+def keyed_bgra(frame, keyed):
+    # New BGRA copy of a BGR(A) frame with the keyed pixels transparent black
+    if frame.shape[2] == 4:
+        bgra = frame.copy()
+    else:
+        bgra = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+    bgra[keyed] = 0
+    return bgra
+
+
+def border_key_color(indexed_frames):
+    # Most common colour on the one pixel border of the frames, as a BGR tuple: the
+    # background of a sprite that does not touch the edges
+    counts = {}
+    for indices, palette in indexed_frames:
+        border = np.concatenate([indices[0], indices[-1], indices[1:-1, 0], indices[1:-1, -1]])
+        entries, entry_counts = np.unique(border, return_counts=True)
+        for color, count in zip(map(tuple, palette[entries].tolist()), entry_counts.tolist()):
+            counts[color] = counts.get(color, 0) + count
+    if not counts:
+        return None
+    return max(counts, key=counts.get)
+
+
+def alpha_lut(lut):
+    # Alpha value per palette entry: keyed entries become transparent
+    return np.where(lut, 0, 255).astype(np.uint8)
+
+
+def save_keyed_gif(indexed_frames, output_path, colors, durations=None, tolerance=5, progress=None,
+                   metric='box', region_seeds=None):
+    # Write a GIF with keyed colours set to black from (indices, BGR palette) frames
+    processed_frames = []
+    keyer = RegionKeyer(region_seeds) if region_seeds is not None else None
+
+    for frame_idx, (indices, palette) in enumerate(indexed_frames):
+        # Set transparent pixels to black by keying the palette
+        processed_palette = palette[:, ::-1].copy()  # RGB
+        lut = key_lut(palette, colors, tolerance, metric)
+        if keyer is None:
+            processed_palette[lut] = 0
+            processed_frames.append(processed_palette[indices])
+        else:
+            # Only the matching regions connected to the seeds
+            frame = processed_palette[indices]
+            frame[keyer.mask(lut[indices])] = 0
+            processed_frames.append(frame)
+        if progress is not None:
+            progress(frame_idx + 1)
+
+    # Save the processed GIF with the source frame delays (in milliseconds)
+    with span("GIF encode (full frames)"):
+        imageio.mimsave(output_path, processed_frames, format='GIF', duration=durations)
+    return len(processed_frames)
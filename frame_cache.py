@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from frame_source import FrameList, GifFrameSource
+
+# Bump when the decoded layout changes so stale entries are never reused
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("CHOREOSPRITE_CACHE_DIR",
+                                        Path.home() / ".cache" / "choreosprite" / "frames"))
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FrameCache:
+    # Decoded frames stored on disk as one .npy array per GIF plus a JSON header,
+    # keyed by the file content hash and decoder mode. Hits are memory-mapped, so
+    # reopening a large GIF costs a hash of the file instead of a full decode.
+    # Entries are evicted least recently used first once max_bytes is exceeded.
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def key(self, file_path, mode):
+        return f"{file_digest(file_path)}-{mode}-v{CACHE_VERSION}"
+
+    def _paths(self, key):
+        return self.cache_dir / (key + ".npy"), self.cache_dir / (key + ".json")
+
+    def load(self, key):
+        array_path, header_path = self._paths(key)
+        try:
+            with open(header_path) as f:
+                header = json.load(f)
+            frames = np.load(array_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if list(frames.shape) != header["shape"]:
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(header_path)
+        except OSError:
+            pass
+        return frames, header["durations"]
+
+    def store(self, key, frames, durations, on_progress=None):
+        # Stream frames into a memory-mapped .npy and publish it atomically
+        num_frames = len(frames)
+        shape = (num_frames,) + tuple(frames.shape)
+        nbytes = int(np.prod(shape))
+        if nbytes > self.max_bytes:
+            return None
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        array_path, header_path = self._paths(key)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        tmp_array_path = array_path.with_name(array_path.name + tmp_suffix)
+
+        try:
+            array = np.lib.format.open_memmap(tmp_array_path, mode='w+', dtype=np.uint8, shape=shape)
+            for index, frame in enumerate(frames):
+                array[index] = frame
+                if on_progress is not None:
+                    on_progress(index + 1)
+            array.flush()
+            del array
+            os.replace(tmp_array_path, array_path)
+        except BaseException:
+            tmp_array_path.unlink(missing_ok=True)
+            raise
+
+        tmp_header_path = header_path.with_name(header_path.name + tmp_suffix)
+        with open(tmp_header_path, 'w') as f:
+            json.dump({"shape": list(shape), "durations": list(durations)}, f)
+        os.replace(tmp_header_path, header_path)
+
+        self.evict()
+        return self.load(key)
+
+    def entries(self):
+        # (last used, size, key) for every complete entry
+        result = []
+        if not self.cache_dir.is_dir():
+            return result
+        for header_path in self.cache_dir.glob("*.json"):
+            array_path = header_path.with_suffix(".npy")
+            try:
+                last_used = header_path.stat().st_mtime
+                size = array_path.stat().st_size + header_path.stat().st_size
+            except OSError:
+                continue
+            result.append((last_used, size, header_path.stem))
+        return result
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+
+
+def default_frame_cache():
+    # Setting CHOREOSPRITE_NO_FRAME_CACHE bypasses the cache
+    return FrameCache(enabled=not os.environ.get("CHOREOSPRITE_NO_FRAME_CACHE"))
+
+
+def open_frames(file_path, mode='BGRA', cache_size=32, frame_cache=None, on_progress=None):
+    # Frames for a GIF, memory-mapped from the cache when possible. Without a usable
+    # cache this is a plain lazily decoded GifFrameSource
+    if frame_cache is None or not frame_cache.enabled:
+        return GifFrameSource(file_path, mode=mode, cache_size=cache_size, on_progress=on_progress)
+
+    key = frame_cache.key(file_path, mode)
+    cached = frame_cache.load(key)
+    if cached is None:
+        # Decode the file once: the store pass also collects the frame delays
+        source = GifFrameSource(file_path, mode=mode, cache_size=cache_size, read_delays=False)
+        try:
+            try:
+                cached = frame_cache.store(key, source, source.durations, on_progress)
+            except OSError:
+                cached = None
+            if cached is None:
+                # Not stored, so read the delays on their own
+                source.load_durations(on_progress)
+                return source
+        except BaseException:
+            source.close()
+            raise
+        source.close()
+
+    frames, durations = cached
+    return FrameList(frames, durations, cache_size=cache_size)
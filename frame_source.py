@@ -0,0 +1,240 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from color_key import palettize
+from profiling import span
+
+
+# Browsers play frames without a delay at 10 fps, so do the same
+DEFAULT_FRAME_DURATION = 100
+
+# Pillow converts every frame after the first to RGB by default, so indexed access had
+# to palettize it again. Frames drawn with the first frame's palette now stay paletted
+GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+
+
+def read_durations(gif, on_progress=None):
+    durations = []
+    try:
+        while True:
+            gif.seek(len(durations))
+            durations.append(gif.info.get('duration') or DEFAULT_FRAME_DURATION)
+            if on_progress is not None:
+                on_progress(len(durations))
+    except EOFError:
+        pass  # End of frames
+    gif.seek(0)
+    return durations
+
+
+def decode_indexed(gif):
+    # Palette indices and BGR palette of the current PIL frame
+    if gif.mode == 'P':
+        with span("decode"):
+            palette = np.array(gif.getpalette('RGB'), dtype=np.uint8).reshape(-1, 3)[:, ::-1]
+            return np.array(gif), np.ascontiguousarray(palette)
+    frame = decode_frame(gif, 'BGR')
+    with span("palettize"):
+        return palettize(frame)
+
+
+def decode_frame(gif, mode):
+    # Convert the current PIL frame to an OpenCV-ordered array
+    if mode == 'BGRA':
+        # Convert to RGBA to preserve transparency
+        with span("decode"):
+            frame = np.array(gif.convert('RGBA'))
+        with span("colour conversion"):
+            return cv2.cvtColor(frame, cv2.COLOR_RGBA2BGRA)
+    if mode == 'BGR':
+        with span("decode"):
+            frame = np.array(gif.convert('RGB'))
+        with span("colour conversion"):
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    raise ValueError(f"Unsupported frame mode: {mode}")
+
+
+class GifFrameSource:
+    # Lazily decoded GIF frames. Random access goes through a small LRU window so
+    # preview scrubbing stays cheap, while iteration streams the file in one pass
+    # without keeping decoded frames around.
+
+    def __init__(self, file_path, mode='BGRA', cache_size=32, on_progress=None, read_delays=True):
+        self.file_path = file_path
+        self.mode = mode
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._indexed_cache = OrderedDict()
+
+        self._gif = Image.open(file_path)
+        self.width, self.height = self._gif.size
+
+        # Per-frame delays in milliseconds, read in the same pass that counts frames.
+        # Without read_delays the frames are only counted, which skips their image data,
+        # and the delays are collected by the first full pass over the frames
+        try:
+            if read_delays:
+                self.load_durations(on_progress)
+            else:
+                self.durations = []
+                self.num_frames = self._gif.n_frames
+        except BaseException:
+            self._gif.close()
+            raise
+
+    def load_durations(self, on_progress=None):
+        self.durations = read_durations(self._gif, on_progress)
+        self.num_frames = len(self.durations)
+
+    def _collect_duration(self, gif, index):
+        if index == len(self.durations):
+            self.durations.append(gif.info.get('duration') or DEFAULT_FRAME_DURATION)
+
+    def __len__(self):
+        return self.num_frames
+
+    def _normalize_index(self, index):
+        if index < 0:
+            index += self.num_frames
+        if not 0 <= index < self.num_frames:
+            raise IndexError("frame index out of range")
+        return index
+
+    def __getitem__(self, index):
+        index = self._normalize_index(index)
+
+        frame = self._cache.get(index)
+        if frame is not None:
+            self._cache.move_to_end(index)
+            return frame
+
+        with span("seek"):
+            self._gif.seek(index)
+        frame = decode_frame(self._gif, self.mode)
+
+        if self.cache_size > 0:
+            self._cache[index] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def indexed(self, index):
+        # Frame as (palette indices, BGR palette), cached in its own LRU window
+        index = self._normalize_index(index)
+
+        entry = self._indexed_cache.get(index)
+        if entry is not None:
+            self._indexed_cache.move_to_end(index)
+            return entry
+
+        with span("seek"):
+            self._gif.seek(index)
+        entry = decode_indexed(self._gif)
+
+        if self.cache_size > 0:
+            self._indexed_cache[index] = entry
+            while len(self._indexed_cache) > self.cache_size:
+                self._indexed_cache.popitem(last=False)
+        return entry
+
+    def native_indexed(self, index):
+        # (palette indices, BGR palette) when the GIF stores the frame paletted, else
+        # None: callers then work on the pixels rather than palettizing them
+        index = self._normalize_index(index)
+
+        entry = self._indexed_cache.get(index)
+        if entry is not None:
+            self._indexed_cache.move_to_end(index)
+            return entry
+
+        with span("seek"):
+            self._gif.seek(index)
+        if self._gif.mode != 'P':
+            return None
+        return self.indexed(index)
+
+    def iter_indexed(self):
+        with Image.open(self.file_path) as gif:
+            for index in range(self.num_frames):
+                with span("seek"):
+                    gif.seek(index)
+                self._collect_duration(gif, index)
+                yield decode_indexed(gif)
+
+    def __iter__(self):
+        # Use a separate handle so streaming does not disturb the preview position
+        with Image.open(self.file_path) as gif:
+            for index in range(self.num_frames):
+                with span("seek"):
+                    gif.seek(index)
+                self._collect_duration(gif, index)
+                yield decode_frame(gif, self.mode)
+
+    @property
+    def shape(self):
+        channels = 4 if self.mode == 'BGRA' else 3
+        return (self.height, self.width, channels)
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._indexed_cache.clear()
+
+    def close(self):
+        self.clear_cache()
+        self._gif.close()
+
+
+class FrameList:
+    # In-memory (or memory-mapped) frames exposing the same interface as GifFrameSource
+
+    def __init__(self, frames, durations=None, cache_size=32):
+        # Arrays are kept as they are so memory-mapped stacks stay on disk
+        self.frames = frames if isinstance(frames, np.ndarray) else list(frames)
+        self.num_frames = len(self.frames)
+        self.durations = list(durations) if durations else [DEFAULT_FRAME_DURATION] * self.num_frames
+        self.height, self.width = self.frames[0].shape[:2] if self.num_frames else (0, 0)
+        self.cache_size = cache_size
+        self._indexed_cache = OrderedDict()
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def indexed(self, index):
+        entry = self._indexed_cache.get(index)
+        if entry is not None:
+            self._indexed_cache.move_to_end(index)
+            return entry
+
+        entry = palettize(self.frames[index][..., :3])
+        if self.cache_size > 0:
+            self._indexed_cache[index] = entry
+            while len(self._indexed_cache) > self.cache_size:
+                self._indexed_cache.popitem(last=False)
+        return entry
+
+    def native_indexed(self, index):
+        # Frames are kept as pixels
+        return None
+
+    def iter_indexed(self):
+        for frame in self.frames:
+            yield palettize(frame[..., :3])
+
+    @property
+    def shape(self):
+        return self.frames[0].shape
+
+    def clear_cache(self):
+        self._indexed_cache.clear()
+
+    def close(self):
+        self._indexed_cache.clear()
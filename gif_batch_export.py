@@ -0,0 +1,404 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from atlas import build_atlas, write_atlas
+from block_reduce import REDUCERS
+from build_manifest import DEFAULT_MANIFEST_NAME, BuildManifest
+from frame_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, FrameCache, file_digest, open_frames
+from grid_detect import detect_grid
+from jobs import export_sprite_job, run_job
+from png_output import (MAX_PALETTE_COLORS, PNG_STRATEGIES, format_png_stats, merge_palettes,
+                        rgba_palette)
+import profiling
+from sprite_export import build_sprite_sheet, extract_tiles, full_frame_selection
+
+
+def collect_inputs(patterns):
+    # Accept directories, glob patterns and plain file paths
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(Path(pattern).glob("*.gif")))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+            paths.extend(Path(match) for match in matches if match.lower().endswith(".gif"))
+
+    # Drop duplicates while keeping the order
+    seen = set()
+    unique_paths = []
+    for path in paths:
+        key = path.resolve()
+        if key not in seen:
+            seen.add(key)
+            unique_paths.append(path)
+    return unique_paths
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError("Manifest must be a JSON object keyed by GIF file name")
+    return manifest
+
+
+def pixel_size_arg(value):
+    if value == "auto":
+        return value
+    try:
+        pixel_size = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive integer or 'auto', got {value!r}") from None
+    if pixel_size < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer or 'auto', got {value!r}")
+    return pixel_size
+
+
+def settings_for(path, args, manifest):
+    settings = {
+        "pixel_size": args.pixel_size,
+        "offset_x": args.offset_x,
+        "offset_y": args.offset_y,
+        "selection": args.selection,
+        "dedupe": args.dedupe,
+        "reducer": args.reducer,
+        "indexed": args.indexed or args.shared_palette,
+        "compress_level": args.png_compress_level,
+        "png_strategy": args.png_strategy,
+    }
+
+    # Manifest entries may be keyed by full path, file name or stem
+    if manifest:
+        settings.update(manifest.get("default", {}))
+        for key in (str(path), path.name, path.stem):
+            if key in manifest:
+                settings.update(manifest[key])
+                break
+    return settings
+
+
+def output_path_for(path, output_dir):
+    target_dir = Path(output_dir) if output_dir else path.parent
+    return str(target_dir / (path.stem + ".png"))
+
+
+def resolve_grid(frames, settings):
+    # pixel_size "auto" detects the pixel size and both offsets from the frames
+    if settings["pixel_size"] != "auto":
+        return settings
+    grid = detect_grid(frames)
+    if grid is None:
+        raise ValueError("No pixel grid detected; set pixel_size for this file")
+    pixel_size, offset_x, offset_y = grid
+    return dict(settings, pixel_size=pixel_size, offset_x=offset_x, offset_y=offset_y)
+
+
+def resolve_selection(frames, settings):
+    # Without an explicit selection export every complete pixel block
+    selection = settings.get("selection")
+    if selection:
+        return tuple(selection[:2]), tuple(selection[2:])
+    return full_frame_selection(frames.shape, settings["pixel_size"],
+                                settings["offset_x"], settings["offset_y"])
+
+
+def export_file(path, output_path, settings, frame_cache=None, palette=None, compare_png=False):
+    start = time.perf_counter()
+
+    # Stream frames straight into the sheet, or memory-map them from the frame cache
+    frames = open_frames(path, cache_size=0, frame_cache=frame_cache)
+    try:
+        settings = resolve_grid(frames, settings)
+        selection_start, selection_end = resolve_selection(frames, settings)
+
+        # Same job function the GUI runs on its worker thread
+        num_frames, num_tiles, png_stats = run_job(
+            export_sprite_job, frames, output_path, selection_start, selection_end,
+            settings["pixel_size"], settings["offset_x"], settings["offset_y"],
+            durations=frames.durations, dedupe=settings.get("dedupe", False),
+            reducer=settings.get("reducer", "nearest"), indexed=settings.get("indexed", False),
+            palette=palette, compress_level=settings.get("compress_level"),
+            png_strategy=settings.get("png_strategy", "default"), compare_png=compare_png)
+    finally:
+        frames.close()
+    return num_frames, num_tiles, png_stats, time.perf_counter() - start
+
+
+def sheet_palette(path, settings, frame_cache=None):
+    # Colours of the sheet this file would export, for a palette shared by the batch
+    frames = open_frames(path, cache_size=0, frame_cache=frame_cache)
+    try:
+        settings = resolve_grid(frames, settings)
+        selection_start, selection_end = resolve_selection(frames, settings)
+        sprite_sheet, _ = build_sprite_sheet(frames, selection_start, selection_end,
+                                             settings["pixel_size"], settings["offset_x"],
+                                             settings["offset_y"],
+                                             reducer=settings.get("reducer", "nearest"))
+    finally:
+        frames.close()
+    return rgba_palette(sprite_sheet)
+
+
+def extract_file_tiles(path, settings, frame_cache=None):
+    start = time.perf_counter()
+
+    frames = open_frames(path, cache_size=0, frame_cache=frame_cache)
+    try:
+        settings = resolve_grid(frames, settings)
+        selection_start, selection_end = resolve_selection(frames, settings)
+        tiles = extract_tiles(frames, selection_start, selection_end, settings["pixel_size"],
+                              settings["offset_x"], settings["offset_y"],
+                              reducer=settings.get("reducer", "nearest"))
+        durations = frames.durations[:len(tiles)]
+    finally:
+        frames.close()
+    return tiles, durations, time.perf_counter() - start
+
+
+def split_stale(jobs, build_manifest, force=False):
+    # Separate jobs whose outputs are up to date with their source and settings
+    stale_jobs = []
+    skipped = []
+    source_hashes = {}
+    for path, output_path, settings in jobs:
+        source_hash = file_digest(path)
+        source_hashes[output_path] = source_hash
+        if not force and build_manifest.is_fresh(output_path, source_hash, settings):
+            skipped.append(output_path)
+        else:
+            stale_jobs.append((path, output_path, settings))
+    return stale_jobs, skipped, source_hashes
+
+
+def collect_shared_palette(jobs, workers, frame_cache=None):
+    # First pass of a shared-palette batch: the union of every sheet's colours
+    palettes = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(profiling.run_profiled, sheet_palette, path, settings, frame_cache): path
+                   for path, _, settings in jobs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                palettes.append(profiling.collect(future.result()))
+            except Exception as e:
+                failures.append((path, e))
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+
+    return merge_palettes(palettes), failures
+
+
+def run_batch(jobs, workers, frame_cache=None, palette=None, compare_png=False):
+    results = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(profiling.run_profiled, export_file, path, output_path, settings,
+                                   frame_cache, palette, compare_png): (path, output_path)
+                   for path, output_path, settings in jobs}
+        for future in as_completed(futures):
+            path, output_path = futures[future]
+            try:
+                num_frames, num_tiles, png_stats, elapsed = profiling.collect(future.result())
+            except Exception as e:
+                failures.append((path, e))
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            results.append((path, output_path, num_frames, num_tiles, png_stats, elapsed))
+            line = f"{path} -> {output_path} ({num_frames} frames, {num_tiles} tiles, {elapsed * 1000:.1f} ms)"
+            if png_stats["colors"] is not None or compare_png:
+                line += f", {format_png_stats(png_stats)}"
+            print(line)
+
+    return results, failures
+
+
+def run_atlas(jobs, workers, atlas_path, max_size, padding, frame_cache=None, **png_options):
+    # Extract unpadded tiles in parallel, then pack every sprite into shared pages
+    extracted = {}
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(profiling.run_profiled, extract_file_tiles, path, settings, frame_cache): path
+                   for path, _, settings in jobs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                tiles, durations, elapsed = profiling.collect(future.result())
+            except Exception as e:
+                failures.append((path, e))
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            extracted[path] = (tiles, durations)
+            print(f"{path} ({len(tiles)} frames of {tiles.shape[2]}x{tiles.shape[1]}, "
+                  f"{elapsed * 1000:.1f} ms)")
+
+    # Pack in input order so reruns produce the same atlas. Sprites are named by file
+    # stem, falling back to the full path when two inputs share a stem
+    stems = Counter(path.stem for path in extracted)
+    sprites = [(path.stem if stems[path.stem] == 1 else str(path),) + extracted[path]
+               for path, _, _ in jobs if path in extracted]
+
+    start = time.perf_counter()
+    with profiling.span("atlas pack"):
+        pages, index = build_atlas(sprites, max_size, padding)
+    pack_time = time.perf_counter() - start
+    index_path = write_atlas(atlas_path, pages, index, **png_options)
+
+    num_tiles = sum(len(tiles) for _, tiles, _ in sprites)
+    print()
+    print(f"Packed {num_tiles} tiles from {len(sprites)} sprite(s) into {len(pages)} page(s) "
+          f"in {pack_time * 1000:.1f} ms, {index['efficiency']:.1%} of the atlas area used")
+    page_bytes = sum(os.path.getsize(Path(index_path).with_name(page["file"])) for page in index["pages"])
+    print(f"Pages: {page_bytes / 1024:.1f} KB of PNG")
+    print(f"Index written to {index_path}")
+    return failures
+
+
+def total_png_stats(all_stats):
+    totals = {"bytes": 0, "encode_time": 0.0}
+    for stats in all_stats:
+        totals["bytes"] += stats["bytes"]
+        totals["encode_time"] += stats["encode_time"]
+        if "baseline_bytes" in stats:
+            totals["baseline_bytes"] = totals.get("baseline_bytes", 0) + stats["baseline_bytes"]
+            totals["baseline_encode_time"] = (totals.get("baseline_encode_time", 0.0)
+                                              + stats["baseline_encode_time"])
+    return totals
+
+
+def print_summary(results, failures, wall_time, skipped=(), saved_time=0.0):
+    total_frames = sum(num_frames for _, _, num_frames, _, _, _ in results)
+    total_tiles = sum(num_tiles for _, _, _, num_tiles, _, _ in results)
+    cpu_time = sum(elapsed for _, _, _, _, _, elapsed in results)
+
+    print()
+    print(f"Exported {len(results)} file(s), {len(failures)} failed")
+    if skipped:
+        print(f"Skipped {len(skipped)} up-to-date file(s), saving about {saved_time:.2f} s")
+    print(f"Wall time: {wall_time:.2f} s, summed per-file time: {cpu_time:.2f} s")
+    if total_tiles:
+        print(f"Tiles: {total_tiles} for {total_frames} frames "
+              f"(dedup ratio {total_frames / total_tiles:.2f}x)")
+    if results:
+        print(f"Output: {format_png_stats(total_png_stats(stats for _, _, _, _, stats, _ in results))}")
+    if wall_time > 0:
+        print(f"Throughput: {len(results) / wall_time:.2f} files/s, "
+              f"{total_frames / wall_time:.1f} frames/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export animated GIFs to pixelated PNG sprite sheets with .mcmeta files.")
+    parser.add_argument("inputs", nargs="+", help="GIF files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="Output directory (default: next to each GIF)")
+    parser.add_argument("--pixel-size", type=pixel_size_arg, default=10,
+                        help="Source pixels per sprite pixel, or 'auto' to detect the grid and offsets "
+                             "of files the manifest gives no pixel_size for (default: 10)")
+    parser.add_argument("--offset-x", type=int, default=0)
+    parser.add_argument("--offset-y", type=int, default=0)
+    parser.add_argument("--selection", type=int, nargs=4, metavar=("X1", "Y1", "X2", "Y2"),
+                        help="Selection corners in source pixels (default: whole frame)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Store identical frames once and reference them from the .mcmeta")
+    parser.add_argument("--reducer", choices=REDUCERS, default="nearest",
+                        help="How each pixel block becomes one sprite pixel (default: nearest)")
+    parser.add_argument("--indexed", action="store_true",
+                        help="Write palette PNGs with a tRNS chunk instead of 32-bit RGBA")
+    parser.add_argument("--shared-palette", action="store_true",
+                        help="Use one palette for every output of the run (implies --indexed)")
+    parser.add_argument("--png-compress-level", type=int, choices=range(10), metavar="0-9",
+                        help="zlib compression level (default: Pillow's)")
+    parser.add_argument("--png-strategy", choices=PNG_STRATEGIES, default="default",
+                        help="zlib strategy for the PNG data")
+    parser.add_argument("--compare-png", action="store_true",
+                        help="Also encode each sheet as default RGBA in memory and report the savings")
+    parser.add_argument("--manifest", help="JSON file with per-file settings keyed by file name")
+    parser.add_argument("--atlas", metavar="OUTPUT_BASE",
+                        help="Pack every GIF into one texture atlas (OUTPUT_BASE_<n>.png + OUTPUT_BASE.json) "
+                             "instead of one sprite sheet per file")
+    parser.add_argument("--atlas-max-size", type=int, default=2048, help="Maximum atlas page size")
+    parser.add_argument("--atlas-padding", type=int, default=0, help="Pixels between atlas tiles")
+    parser.add_argument("--build-manifest",
+                        help=f"Build manifest used to skip unchanged outputs "
+                             f"(default: {DEFAULT_MANIFEST_NAME} in the output directory)")
+    parser.add_argument("--force", action="store_true", help="Rebuild every output, even if up to date")
+    parser.add_argument("--no-frame-cache", action="store_true",
+                        help="Decode every GIF instead of using the on-disk frame cache")
+    parser.add_argument("--frame-cache-dir", help=f"Frame cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--frame-cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Frame cache size limit in MiB")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: CPU count)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiling.enable_from_args(args)
+
+    manifest = load_manifest(args.manifest) if args.manifest else None
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        parser.error("No GIF files found")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = [(path, output_path_for(path, args.output_dir), settings_for(path, args, manifest))
+            for path in paths]
+
+    frame_cache = FrameCache(args.frame_cache_dir, args.frame_cache_size * 1024 * 1024,
+                             enabled=not args.no_frame_cache)
+
+    if args.atlas:
+        atlas_path = os.path.join(args.output_dir, args.atlas) if args.output_dir else args.atlas
+        failures = run_atlas(jobs, args.workers, atlas_path, args.atlas_max_size, args.atlas_padding,
+                             frame_cache, indexed=args.indexed or args.shared_palette,
+                             compress_level=args.png_compress_level, png_strategy=args.png_strategy)
+        return 1 if failures else 0
+
+    # A shared palette is collected from every input first. Its digest joins the settings,
+    # so a palette change rebuilds every output that uses it
+    palette = None
+    palette_failures = []
+    if args.shared_palette:
+        palette, palette_failures = collect_shared_palette(jobs, args.workers, frame_cache)
+        if len(palette) > MAX_PALETTE_COLORS:
+            print(f"Shared palette needs {len(palette)} colours, more than {MAX_PALETTE_COLORS}; "
+                  f"drop --shared-palette to quantize each sheet separately", file=sys.stderr)
+            return 1
+        failed_paths = {path for path, _ in palette_failures}
+        palette_digest = hashlib.blake2b(palette.tobytes(), digest_size=16).hexdigest()
+        jobs = [(path, output_path, dict(settings, palette=palette_digest))
+                for path, output_path, settings in jobs if path not in failed_paths]
+
+    # Only rebuild outputs whose source or settings changed since the last run
+    build_manifest = BuildManifest(args.build_manifest
+                                   or os.path.join(args.output_dir or ".", DEFAULT_MANIFEST_NAME))
+    jobs, skipped, source_hashes = split_stale(jobs, build_manifest, args.force)
+    saved_time = sum(build_manifest.build_time(output_path) for output_path in skipped)
+
+    start = time.perf_counter()
+    results, failures = run_batch(jobs, args.workers, frame_cache, palette, args.compare_png)
+    failures = palette_failures + failures
+
+    settings_by_output = {output_path: settings for _, output_path, settings in jobs}
+    for path, output_path, _, _, _, elapsed in results:
+        build_manifest.record(output_path, path, source_hashes[output_path],
+                              settings_by_output[output_path], elapsed)
+    build_manifest.save()
+
+    print_summary(results, failures, time.perf_counter() - start, skipped, saved_time)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
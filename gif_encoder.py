@@ -0,0 +1,367 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from color_key import key_lut, save_keyed_gif
+from profiling import span
+from region_key import RegionKeyer
+
+# Packed RGB never sets bit 24, so it marks transparent pixels on the canvas model
+TRANSPARENT = np.uint32(1 << 24)
+
+# Graphic Control Extension disposal methods
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+
+MAX_GIF_COLORS = 256
+
+# Encoded frames wait in memory up to this size, then in a temporary file, until the
+# global palette is known and the file can be assembled
+SPOOL_BYTES = 4 * 1024 * 1024
+
+
+def _pack_rgb(palette_rgb):
+    palette_rgb = palette_rgb.astype(np.uint32)
+    return (palette_rgb[:, 0] << 16) | (palette_rgb[:, 1] << 8) | palette_rgb[:, 2]
+
+
+def _unpack_rgb(packed):
+    return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=1).astype(np.uint8)
+
+
+def _bbox(mask):
+    # (x1, y1, x2, y2) of the set pixels, or None
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def _union(rect, other):
+    if rect is None:
+        return other
+    if other is None:
+        return rect
+    return (min(rect[0], other[0]), min(rect[1], other[1]),
+            max(rect[2], other[2]), max(rect[3], other[3]))
+
+
+class _KeyTable:
+    # key_lut over the palettes of a frame stream. Frames mostly share their colours,
+    # so distances are computed once per distinct colour as new colours turn up
+
+    def __init__(self, colors, tolerance=5, metric='box'):
+        self.colors = colors
+        self.tolerance = tolerance
+        self.metric = metric
+        self.known = np.zeros(0, dtype=np.uint32)
+        self.keyed = np.zeros(0, dtype=bool)
+
+    def lut(self, palette):
+        # Packed BGR, only used to look colours up
+        packed = _pack_rgb(palette)
+        new = np.setdiff1d(packed, self.known)
+        if len(new):
+            keyed = key_lut(_unpack_rgb(new), self.colors, self.tolerance, self.metric)
+            known = np.concatenate([self.known, new])
+            order = np.argsort(known)
+            self.known = known[order]
+            self.keyed = np.concatenate([self.keyed, keyed])[order]
+        return self.keyed[np.searchsorted(self.known, packed)]
+
+
+def _key_frame(indices, palette, key_table, keyer=None):
+    # Canvas-model frame: packed RGB per pixel, keyed pixels set to TRANSPARENT. With a
+    # region keyer only matching regions connected to its seeds are keyed
+    lut = key_table.lut(palette)
+    packed = _pack_rgb(palette[:, ::-1])
+    if keyer is None:
+        packed[lut] = TRANSPARENT
+        return packed[indices]
+    frame = packed[indices]
+    frame[keyer.mask(lut[indices])] = TRANSPARENT
+    return frame
+
+
+class _SourceTimer:
+    # Iterates frames, adding up the time spent producing them (decoding), so encode
+    # times can leave it out
+
+    def __init__(self, frames):
+        self.iterator = iter(frames)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def _quantize_rect(target):
+    # Frames composited from several local palettes can hold more colours than a GIF
+    # frame allows: reduce the opaque pixels to 255 colours, leaving room for the
+    # transparent index. Returns the sorted colours and the quantized rectangle
+    opaque = target != TRANSPARENT
+    rgb = np.zeros(target.shape + (3,), dtype=np.uint8)
+    rgb[opaque] = _unpack_rgb(target[opaque])
+    quantized = Image.fromarray(rgb, 'RGB').quantize(MAX_GIF_COLORS - 1, method=Image.Quantize.MEDIANCUT)
+    palette = np.array(quantized.getpalette()[:3 * (MAX_GIF_COLORS - 1)], dtype=np.uint8).reshape(-1, 3)
+    target = _pack_rgb(palette)[np.array(quantized)]
+    target[~opaque] = TRANSPARENT
+    return np.unique(target[opaque]), target
+
+
+class _PendingFrame:
+    # A frame whose rectangle and disposal are only final once the next frame is known
+
+    def __init__(self, rect, underlying, target, duration):
+        self.rect = rect
+        self.underlying = underlying
+        self.target = target
+        self.duration = duration
+        self.disposal = DISPOSE_NONE
+
+
+class KeyedGifEncoder:
+    # Writes colour-keyed frames as an optimized GIF as they arrive: keyed pixels use a
+    # real transparent index, and each frame only stores the bounding box that changed
+    # since the previous one. Pixels inside that box which did not change are written
+    # as transparent too, which compresses better. When pixels have to turn transparent
+    # the previous frame is disposed to background over an area covering them.
+    # Colours join a global palette in the order they first appear, behind the
+    # transparent index 0; once it is full, frames bringing new colours carry a local
+    # palette instead. The global palette goes in the header but is only complete at
+    # the end, so frames are spooled and close() assembles the file.
+
+    def __init__(self, fp, width, height, loop=None):
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.pending = None
+        self.canvas = np.full((height, width), TRANSPARENT, dtype=np.uint32)
+        self.body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        self.frames_written = 0
+        self.local_palettes = 0
+
+        # Global palette colours in index order (colour i has index i + 1), and the
+        # same colours sorted with their indices for lookups
+        self.global_colors = np.zeros(0, dtype=np.uint32)
+        self.sorted_colors = np.zeros(0, dtype=np.uint32)
+        self.sorted_indices = np.zeros(0, dtype=np.uint8)
+
+    def _write_header(self):
+        flags = 0
+        table = b""
+        if self.frames_written > self.local_palettes:
+            size_bits = max(1, int(np.ceil(np.log2(len(self.global_colors) + 1))))
+            table = np.zeros((1 << size_bits, 3), dtype=np.uint8)
+            table[1:len(self.global_colors) + 1] = _unpack_rgb(self.global_colors)
+            table = table.tobytes()
+            flags = 0x80 | ((size_bits - 1) << 4) | (size_bits - 1)
+        self.fp.write(b"GIF89a" + struct.pack("<HHBBB", self.width, self.height, flags, 0, 0) + table)
+        if self.loop is not None:
+            self.fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+    def _add_global_colors(self, colors):
+        # Give the sorted colours global indices; False when they do not all fit
+        new = colors[~np.isin(colors, self.sorted_colors, assume_unique=True)]
+        if len(self.global_colors) + len(new) > MAX_GIF_COLORS - 1:
+            return False
+        if len(new):
+            self.global_colors = np.concatenate([self.global_colors, new])
+            order = np.argsort(self.global_colors)
+            self.sorted_colors = self.global_colors[order]
+            self.sorted_indices = (order + 1).astype(np.uint8)
+        return True
+
+    def add_frame(self, target, duration):
+        # target: packed RGB per pixel with TRANSPARENT for keyed pixels
+        pending = self.pending
+        if pending is not None:
+            if np.array_equal(pending.target, target):
+                # Same picture as the previous frame: show that one for longer
+                pending.duration += duration
+                return
+            underlying = self._settle(pending, target)
+        else:
+            underlying = self.canvas
+
+        # Nothing changed after disposal still needs a frame to carry the delay; a
+        # single pixel with the transparent index leaves the canvas as it is
+        rect = _bbox(underlying != target) or (0, 0, 1, 1)
+        self.pending = _PendingFrame(rect, underlying, target, duration)
+
+    def _settle(self, pending, next_target):
+        # Fix the disposal of the pending frame given the frame that follows it, write
+        # it, and return the canvas the next frame is drawn over
+        must_clear = (pending.target != TRANSPARENT) & (next_target == TRANSPARENT)
+        clear_rect = _bbox(must_clear)
+        if clear_rect is not None:
+            pending.disposal = DISPOSE_BACKGROUND
+            pending.rect = _union(pending.rect, clear_rect)
+        self._write_frame(pending)
+
+        # Read the target after writing, which may have quantized it
+        canvas = pending.target
+        if pending.disposal == DISPOSE_BACKGROUND:
+            x1, y1, x2, y2 = pending.rect
+            canvas = canvas.copy()
+            canvas[y1:y2, x1:x2] = TRANSPARENT
+        return canvas
+
+    def _write_frame(self, frame):
+        x1, y1, x2, y2 = frame.rect
+        target = frame.target[y1:y2, x1:x2]
+        unchanged = frame.underlying[y1:y2, x1:x2] == target
+        params = {"duration": round(frame.duration / 10) * 10, "disposal": frame.disposal}
+
+        colors = np.unique(target[target != TRANSPARENT])
+        if self._add_global_colors(colors):
+            if len(self.sorted_colors):
+                positions = np.minimum(np.searchsorted(self.sorted_colors, target), len(self.sorted_colors) - 1)
+                indices = self.sorted_indices[positions]
+            else:
+                indices = np.zeros(target.shape, dtype=np.uint8)
+            indices[(target == TRANSPARENT) | unchanged] = 0
+            img = Image.fromarray(indices, 'P')
+            params["transparency"] = 0
+        else:
+            if len(colors) > MAX_GIF_COLORS or (len(colors) == MAX_GIF_COLORS and
+                                                (target == TRANSPARENT).any()):
+                colors, target = _quantize_rect(target)
+                frame.target = frame.target.copy()
+                frame.target[y1:y2, x1:x2] = target
+                unchanged = frame.underlying[y1:y2, x1:x2] == target
+
+            # The transparent index comes after the colours. A rectangle with 256
+            # colours and no keyed pixels is written opaque, changed or not
+            indices = np.searchsorted(colors, target).astype(np.uint8)
+            if len(colors) < MAX_GIF_COLORS:
+                params["transparency"] = len(colors)
+                indices[(target == TRANSPARENT) | unchanged] = len(colors)
+            img = Image.fromarray(indices, 'P')
+            palette = np.zeros((len(colors) + ("transparency" in params), 3), dtype=np.uint8)
+            palette[:len(colors)] = _unpack_rgb(colors)
+            img.putpalette(palette.tobytes())
+            params["include_color_table"] = True
+            self.local_palettes += 1
+
+        # Pillow's LZW encoder writes the control extension, descriptor and image data
+        for chunk in GifImagePlugin.getdata(img, (x1, y1), **params):
+            self.body.write(chunk)
+        self.frames_written += 1
+
+    def close(self):
+        if self.pending is not None:
+            if self.loop is not None:
+                # Leave an empty canvas behind so the next loop starts from scratch
+                self.canvas = self._settle(self.pending, np.full_like(self.canvas, TRANSPARENT))
+            else:
+                self._write_frame(self.pending)
+            self.pending = None
+
+        # Header and global palette, then the spooled frames
+        self._write_header()
+        self.body.seek(0)
+        shutil.copyfileobj(self.body, self.fp)
+        self.body.close()
+        self.fp.write(b";")
+
+
+def encode_keyed_gif(indexed_frames, output_path, colors, durations=None, tolerance=5, progress=None,
+                     loop=None, metric='box', region_seeds=None):
+    # Optimized counterpart of save_keyed_gif taking the same (indices, BGR palette)
+    # frames. Frames are keyed and encoded as they arrive, holding only the current
+    # and the previous one. encode_time leaves out producing the frames. Returns
+    # statistics about the file
+    start = time.perf_counter()
+    source = _SourceTimer(indexed_frames)
+    key_table = _KeyTable(colors, tolerance, metric)
+    keyer = RegionKeyer(region_seeds) if region_seeds is not None else None
+    encoder = None
+    fp = None
+    num_frames = 0
+    keyed_pixels = 0
+    try:
+        for frame_idx, (indices, palette) in enumerate(source):
+            with span("mask build"):
+                frame = _key_frame(indices, palette, key_table, keyer)
+            if encoder is None:
+                fp = open(output_path, 'wb')
+                encoder = KeyedGifEncoder(fp, frame.shape[1], frame.shape[0], loop)
+            duration = durations[frame_idx] if durations is not None else 100
+            with span("GIF encode"):
+                encoder.add_frame(frame, duration)
+            keyed_pixels += np.count_nonzero(frame == TRANSPARENT)
+            num_frames += 1
+            if progress is not None:
+                progress(frame_idx + 1)
+        if encoder is None:
+            raise ValueError("Cannot save a GIF without frames")
+        with span("GIF encode"):
+            encoder.close()
+        size = fp.tell()
+        fp.close()
+    except BaseException:
+        # No half-written GIF is left behind on failure or cancellation
+        if fp is not None:
+            fp.close()
+            os.remove(output_path)
+        raise
+
+    return {
+        "frames": num_frames,
+        "frames_written": encoder.frames_written,
+        "pixels": num_frames * encoder.width * encoder.height,
+        "keyed_pixels": int(keyed_pixels),
+        "global_palette": encoder.local_palettes == 0,
+        "bytes": size,
+        "encode_time": time.perf_counter() - start - source.elapsed,
+    }
+
+
+def save_optimized_gif(frames, output_path, colors, durations=None, tolerance=5, progress=None,
+                       compare=False, metric='box', region_seeds=None):
+    # Stream a frame source (GifFrameSource or FrameList) through encode_keyed_gif.
+    # With compare, the source is read again and written the old way (keyed pixels
+    # painted black, full frames through imageio) in memory so the savings can be
+    # reported; decoding is left out of both times
+    stats = encode_keyed_gif(frames.iter_indexed(), output_path, colors, durations, tolerance, progress,
+                             metric=metric, region_seeds=region_seeds)
+    if compare:
+        buffer = io.BytesIO()
+        source = _SourceTimer(frames.iter_indexed())
+        start = time.perf_counter()
+        save_keyed_gif(source, buffer, colors, durations, tolerance, metric=metric,
+                       region_seeds=region_seeds)
+        stats["baseline_encode_time"] = time.perf_counter() - start - source.elapsed
+        stats["baseline_bytes"] = buffer.tell()
+    return stats
+
+
+def format_gif_stats(stats):
+    # One line summary, with savings when a baseline was measured
+    text = (f"GIF {stats['bytes'] / 1024:.1f} KB in {stats['encode_time'] * 1000:.1f} ms, "
+            f"{stats['frames_written']} of {stats['frames']} frames stored, "
+            f"{'global' if stats['global_palette'] else 'local'} palette")
+    if stats.get("baseline_bytes"):
+        size_change = stats["bytes"] / stats["baseline_bytes"] - 1
+        time_change = stats["encode_time"] / max(stats["baseline_encode_time"], 1e-9) - 1
+        text += (f"; full frames {stats['baseline_bytes'] / 1024:.1f} KB in "
+                 f"{stats['baseline_encode_time'] * 1000:.1f} ms "
+                 f"({abs(size_change):.0%} {'smaller' if size_change <= 0 else 'larger'}, "
+                 f"{abs(time_change):.0%} {'less' if time_change <= 0 else 'more'} encode time)")
+    return text
@@ -0,0 +1,167 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from color_key import KEY_METRICS, border_key_color
+from frame_cache import open_frames
+from gif_batch_export import collect_inputs
+from gif_encoder import encode_keyed_gif
+import profiling
+from region_key import BORDER_SEEDS
+
+
+def color_arg(value):
+    # "#RRGGBB", "RRGGBB" or "R,G,B" -> BGR tuple, the order frames are keyed in
+    text = value.strip()
+    try:
+        if "," in text:
+            rgb = tuple(int(part) for part in text.split(","))
+        else:
+            text = text.lstrip("#")
+            if len(text) != 6:
+                raise ValueError
+            rgb = tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected #RRGGBB or R,G,B, got {value!r}") from None
+    if len(rgb) != 3 or not all(0 <= channel <= 255 for channel in rgb):
+        raise argparse.ArgumentTypeError(f"expected #RRGGBB or R,G,B, got {value!r}")
+    return rgb[::-1]
+
+
+def format_color(bgr):
+    return "#{:02x}{:02x}{:02x}".format(*bgr[::-1])
+
+
+def output_path_for(path, output_dir):
+    # Next to the source with a suffix, or under the same name in the output directory
+    if output_dir:
+        return str(Path(output_dir) / path.name)
+    return str(path.with_name(path.stem + "_keyed.gif"))
+
+
+def key_file(path, output_path, colors, tolerance, metric, auto_key=False, from_border=False):
+    start = time.perf_counter()
+
+    frames = open_frames(path, mode='BGR', cache_size=0)
+    try:
+        # Frames are streamed, never all held: --auto-key reads the file once for the
+        # border colours before the encoding pass
+        colors = list(colors)
+        if auto_key:
+            border_color = border_key_color(frames.iter_indexed())
+            if border_color is not None and border_color not in colors:
+                colors.append(border_color)
+        if not colors:
+            raise ValueError("No key colour to remove")
+
+        stats = encode_keyed_gif(frames.iter_indexed(), output_path, colors, frames.durations, tolerance,
+                                 metric=metric, region_seeds=BORDER_SEEDS if from_border else None)
+    finally:
+        frames.close()
+    stats["key_colors"] = colors
+    stats["input_bytes"] = os.path.getsize(path)
+    return stats, time.perf_counter() - start
+
+
+def run_batch(jobs, workers, colors, tolerance, metric, auto_key=False, from_border=False):
+    results = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(profiling.run_profiled, key_file, path, output_path, colors, tolerance,
+                                   metric, auto_key, from_border):
+                   (path, output_path)
+                   for path, output_path in jobs}
+        for future in as_completed(futures):
+            path, output_path = futures[future]
+            try:
+                stats, elapsed = profiling.collect(future.result())
+            except Exception as e:
+                failures.append((path, e))
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            results.append((path, output_path, stats, elapsed))
+            print(f"{path} -> {output_path} ({stats['frames']} frames, "
+                  f"{stats['keyed_pixels'] / stats['pixels']:.1%} keyed, "
+                  f"{stats['bytes'] / 1024:.1f} KB, {elapsed * 1000:.1f} ms, "
+                  f"key {' '.join(format_color(color) for color in stats['key_colors'])})")
+
+    return results, failures
+
+
+def print_summary(results, failures, wall_time):
+    total_frames = sum(stats["frames"] for _, _, stats, _ in results)
+    total_pixels = sum(stats["pixels"] for _, _, stats, _ in results)
+    input_bytes = sum(stats["input_bytes"] for _, _, stats, _ in results)
+    output_bytes = sum(stats["bytes"] for _, _, stats, _ in results)
+    cpu_time = sum(elapsed for _, _, _, elapsed in results)
+
+    print()
+    print(f"Keyed {len(results)} file(s), {len(failures)} failed")
+    print(f"Wall time: {wall_time:.2f} s, summed per-file time: {cpu_time:.2f} s")
+    if results:
+        print(f"Size: {input_bytes / 1024 / 1024:.2f} MiB in, {output_bytes / 1024 / 1024:.2f} MiB out")
+    if wall_time > 0:
+        print(f"Throughput: {len(results) / wall_time:.2f} files/s, {total_frames / wall_time:.1f} frames/s, "
+              f"{total_pixels / wall_time / 1e6:.1f} Mpixels/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Make key colours of animated GIFs transparent without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="GIF files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir",
+                        help="Output directory (default: <name>_keyed.gif next to each GIF)")
+    parser.add_argument("-k", "--key-color", type=color_arg, action="append", default=[],
+                        metavar="COLOR", help="Colour to remove, as #RRGGBB or R,G,B (repeatable)")
+    parser.add_argument("--auto-key", action="store_true",
+                        help="Also remove the most common colour on each file's frame border")
+    parser.add_argument("--from-border", action="store_true",
+                        help="Only remove key-coloured regions connected to the frame border, "
+                             "keeping matching pixels inside sprites")
+    parser.add_argument("-t", "--tolerance", type=float, default=5,
+                        help="Largest distance from a key colour that is still removed (default: 5)")
+    parser.add_argument("--metric", choices=KEY_METRICS, default="box",
+                        help="Colour distance: per-channel box, Euclidean RGB or CIELAB Delta E "
+                             "(default: box)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: CPU count)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiling.enable_from_args(args)
+
+    if not args.key_color and not args.auto_key:
+        parser.error("Give at least one --key-color or use --auto-key")
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        parser.error("No GIF files found")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = []
+    outputs = {Path(output_path_for(path, args.output_dir)).resolve() for path in paths}
+    for path in paths:
+        output_path = output_path_for(path, args.output_dir)
+        if Path(output_path).resolve() == path.resolve():
+            parser.error(f"Output would overwrite its source: {path}")
+        if path.resolve() in outputs:
+            # Written by another job of this batch, e.g. a *_keyed.gif from an earlier run
+            # over the same directory; keying it again would give *_keyed_keyed.gif
+            print(f"Skipping {path}: it is the output of another input", file=sys.stderr)
+            continue
+        jobs.append((path, output_path))
+
+    start = time.perf_counter()
+    results, failures = run_batch(jobs, args.workers, args.key_color, args.tolerance, args.metric,
+                                  args.auto_key, args.from_border)
+    print_summary(results, failures, time.perf_counter() - start)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
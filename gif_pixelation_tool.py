@@ -1,11 +1,21 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
-from PIL import Image, ImageTk
-import cv2
-import numpy as np
 import imageio
 from pathlib import Path
 
+from block_reduce import REDUCERS
+from color_key import KEY_METRICS, key_mask, keyed_bgra
+from frame_cache import default_frame_cache
+from frame_source import FrameList
+from jobs import JobController, decode_gif_job, detect_grid_job, export_keyed_sprite_job, export_sprite_job
+from playback import PlaybackScheduler
+from png_output import format_png_stats
+from preview_canvas import PreviewCanvas
+from profiling import span
+from region_key import BORDER_SEEDS, RegionKeyer
+from render_cache import RenderCache, display_size, grid_mask, render_pixelated
+from sprite_export import align_selection
+
 class PixelationTool:
     def __init__(self, root):
         self.root = root
@@ -13,6 +23,10 @@ class PixelationTool:
         
         # Variables
         self.frames = []
+        self.frame_cache_size = 32
+        # Decoded frames are kept on disk between sessions
+        self.frame_cache = default_frame_cache()
+        self.render_cache = RenderCache(max_bytes=256 * 1024 * 1024)
         self.current_frame_index = 0
         self.selection_start = None
         self.selection_end = None
@@ -20,13 +34,27 @@ class PixelationTool:
         self.pixel_size = tk.IntVar(value=10)
         self.offset_x = tk.IntVar(value=0)
         self.offset_y = tk.IntVar(value=0)
+        self.dedupe = tk.BooleanVar(value=False)
+        self.reducer = tk.StringVar(value='nearest')
+        self.indexed = tk.BooleanVar(value=False)
+        # Colours keyed out on export (BGR), with real alpha instead of black
+        self.key_colors = []
+        self.is_picking = False
+        self.tolerance = tk.IntVar(value=5)
+        self.key_metric = tk.StringVar(value='box')
+        self.key_from_border = tk.BooleanVar(value=False)
+        self.region_keyer = None
         
         # Create GUI elements
         self.create_widgets()
         
+        # Decoding and export run on worker threads
+        self.jobs = JobController(self.root, lambda text: self.status_label.configure(text=text))
+        
         # Animation control
         self.is_playing = False
         self.after_id = None
+        self.scheduler = None
         
     def create_widgets(self):
         # Controls frame
@@ -54,17 +82,53 @@ class PixelationTool:
                                    textvariable=self.offset_y, command=self.update_preview)
         offset_y_spin.pack(side=tk.LEFT, padx=5)
         
+        # How each pixel block is reduced to one sprite pixel
+        ttk.Label(controls_frame, text="Sampling:").pack(side=tk.LEFT, padx=5)
+        reducer_combo = ttk.Combobox(controls_frame, values=REDUCERS, width=10, state='readonly',
+                                     textvariable=self.reducer)
+        reducer_combo.bind('<<ComboboxSelected>>', lambda event: self.update_preview())
+        reducer_combo.pack(side=tk.LEFT, padx=5)
+        
+        # Estimate pixel size and offsets from the loaded frames
+        self.detect_btn = ttk.Button(controls_frame, text="Detect Grid", command=self.detect_grid)
+        self.detect_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Colour key controls
+        key_frame = ttk.Frame(self.root)
+        key_frame.pack(pady=5, padx=5, fill=tk.X)
+        
+        self.pick_btn = ttk.Button(key_frame, text="Pick Key Colour", command=self.start_picking)
+        self.pick_btn.pack(side=tk.LEFT, padx=5)
+        ttk.Button(key_frame, text="Clear Keys", command=self.clear_key_colors).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(key_frame, text="Tolerance:").pack(side=tk.LEFT, padx=5)
+        ttk.Spinbox(key_frame, from_=0, to=255, width=5, textvariable=self.tolerance,
+                    command=self.key_changed).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(key_frame, text="Metric:").pack(side=tk.LEFT, padx=5)
+        metric_combo = ttk.Combobox(key_frame, values=KEY_METRICS, width=6, state='readonly',
+                                    textvariable=self.key_metric)
+        metric_combo.bind('<<ComboboxSelected>>', lambda event: self.key_changed())
+        metric_combo.pack(side=tk.LEFT, padx=5)
+        
+        # Only key regions connected to the frame border
+        ttk.Checkbutton(key_frame, text="From border", variable=self.key_from_border,
+                        command=self.key_changed).pack(side=tk.LEFT, padx=5)
+        
+        self.key_colors_label = ttk.Label(key_frame, text="Key colours: none")
+        self.key_colors_label.pack(side=tk.LEFT, padx=5)
+        
         # Preview frame
         self.preview_frame = ttk.Frame(self.root)
         self.preview_frame.pack(pady=10)
         
-        self.preview_label = ttk.Label(self.preview_frame)
-        self.preview_label.pack()
+        # Persistent canvas; frames are pasted into its image in place
+        self.preview = PreviewCanvas(self.preview_frame)
         
         # Bind mouse events for selection
-        self.preview_label.bind('<Button-1>', self.start_selection)
-        self.preview_label.bind('<B1-Motion>', self.update_selection)
-        self.preview_label.bind('<ButtonRelease-1>', self.end_selection)
+        self.preview.bind('<Button-1>', self.start_selection)
+        self.preview.bind('<B1-Motion>', self.update_selection)
+        self.preview.bind('<ButtonRelease-1>', self.end_selection)
         
         # Animation controls
         control_frame = ttk.Frame(self.root)
@@ -76,90 +140,179 @@ class PixelationTool:
         # Export button
         self.export_btn = ttk.Button(control_frame, text="Export Selection", command=self.export_selection)
         self.export_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Store identical frames once in the sprite sheet
+        ttk.Checkbutton(control_frame, text="Dedupe Frames", variable=self.dedupe).pack(side=tk.LEFT, padx=5)
+        
+        # Palette PNG with a tRNS chunk instead of 32-bit RGBA
+        ttk.Checkbutton(control_frame, text="Indexed PNG", variable=self.indexed).pack(side=tk.LEFT, padx=5)
+        
+        # Cancel the running load or export
+        self.cancel_btn = ttk.Button(control_frame, text="Cancel", command=self.cancel_job)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Sustained playback rate
+        self.fps_label = ttk.Label(control_frame, text="FPS: -")
+        self.fps_label.pack(side=tk.LEFT, padx=5)
+        
+        # Background job status
+        self.status_label = ttk.Label(self.root, text="Ready")
+        self.status_label.pack(pady=5)
     
     def upload_gif(self):
         file_path = filedialog.askopenfilename(filetypes=[("GIF files", "*.gif")])
         if file_path:
-            self.frames = []
-            gif = Image.open(file_path)
+            # Stop playback of the previous file while the new one loads
+            self.is_playing = False
+            self.scheduler = None
+            if self.after_id:
+                self.root.after_cancel(self.after_id)
             
-            try:
-                while True:
-                    # Convert to RGBA to preserve transparency
-                    frame = gif.convert('RGBA')
-                    # Convert to numpy array
-                    frame_array = np.array(frame)
-                    # Convert from RGBA to BGRA for OpenCV
-                    frame_bgra = cv2.cvtColor(frame_array, cv2.COLOR_RGBA2BGRA)
-                    self.frames.append(frame_bgra)
-                    
-                    gif.seek(gif.tell() + 1)
-            except EOFError:
-                pass  # End of frames
-            
-            self.current_frame_index = 0
-            self.show_frame(self.current_frame_index)
-            self.is_playing = True
-            self.animate()
+            # Decode in the background; the first frame is shown as soon as it is ready
+            self.jobs.start("Loading frame", decode_gif_job, file_path, 'BGRA', self.frame_cache_size,
+                            self.frame_cache, handlers={'first_frame': self.show_first_frame, 'done': self.gif_loaded})
+    
+    def show_first_frame(self, frame):
+        self.set_frames(FrameList([frame]))
+    
+    def gif_loaded(self, frames):
+        # Frames are decoded on demand, keeping only a small window in memory
+        self.set_frames(frames)
+        self.scheduler = PlaybackScheduler(self.frames.durations)
+        
+        self.is_playing = True
+        self.scheduler.start(self.current_frame_index)
+        self.animate()
+        
+        # Fill in the grid settings for upscaled pixel art
+        self.detect_grid()
+    
+    def set_frames(self, frames):
+        if self.frames:
+            self.frames.close()
+        self.frames = frames
+        self.render_cache.clear()
+        
+        self.current_frame_index = 0
+        self.show_frame(self.current_frame_index)
+    
+    def cancel_job(self):
+        self.jobs.cancel()
+    
+    def detect_grid(self):
+        if not self.frames or self.jobs.busy:
+            return
+        self.jobs.start("Detecting grid", detect_grid_job, self.frames,
+                        handlers={'done': self.grid_detected})
+    
+    def grid_detected(self, grid):
+        if grid is None:
+            self.status_label.configure(text="No pixel grid detected")
+            return
+        
+        pixel_size, offset_x, offset_y = grid
+        self.pixel_size.set(pixel_size)
+        self.offset_x.set(offset_x)
+        self.offset_y.set(offset_y)
+        self.status_label.configure(text=f"Detected {pixel_size}px grid at offset ({offset_x}, {offset_y})")
+        self.update_preview()
     
     def show_frame(self, index):
         if not self.frames:
             return
-            
-        frame = self.frames[index].copy()
-        h, w = frame.shape[:2]
         
-        # Create visualization frame with pixel grid
         pixel_size = self.pixel_size.get()
         offset_x = self.offset_x.get()
         offset_y = self.offset_y.get()
+        reducer = self.reducer.get()
         
-        # Calculate new dimensions
-        new_h = (h - offset_y) // pixel_size
-        new_w = (w - offset_x) // pixel_size
-        
-        # Create pixelated preview
-        preview = frame.copy()
-        # Crop to fit complete pixels
-        preview = preview[offset_y:offset_y + new_h * pixel_size, 
-                        offset_x:offset_x + new_w * pixel_size]
-        
-        # Resize down and up to show pixelation
-        preview = cv2.resize(preview, (new_w, new_h), interpolation=cv2.INTER_NEAREST)
-        preview = cv2.resize(preview, (new_w * pixel_size, new_h * pixel_size), 
-                           interpolation=cv2.INTER_NEAREST)
-        
-        # Put pixelated preview back into frame
-        frame[offset_y:offset_y + preview.shape[0], 
-              offset_x:offset_x + preview.shape[1]] = preview
-        
-        # Draw grid lines
-        for x in range(offset_x, w, pixel_size):
-            cv2.line(frame, (x, 0), (x, h), (0, 255, 0), 1)
-        for y in range(offset_y, h, pixel_size):
-            cv2.line(frame, (0, y), (w, y), (0, 255, 0), 1)
+        # Pixelated frame with grid overlay, already scaled for display
+        with span("show_frame"):
+            self.preview.show(self.render_base(index, pixel_size, offset_x, offset_y, reducer))
+            self.draw_selection()
+    
+    def draw_selection(self):
+        # Selection rectangle aligned to pixel grid, drawn as a canvas item
+        if not self.selection_start or not self.selection_end:
+            self.preview.set_rectangle(None)
+            return
         
-        # Draw selection rectangle aligned to pixel grid
-        if self.selection_start and self.selection_end:
-            # Align selection to pixel grid
-            x1 = ((self.selection_start[0] - offset_x) // pixel_size) * pixel_size + offset_x
-            y1 = ((self.selection_start[1] - offset_y) // pixel_size) * pixel_size + offset_y
-            x2 = ((self.selection_end[0] - offset_x) // pixel_size + 1) * pixel_size + offset_x
-            y2 = ((self.selection_end[1] - offset_y) // pixel_size + 1) * pixel_size + offset_y
-            
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        x1, y1, x2, y2 = align_selection(self.selection_start, self.selection_end,
+                                         self.pixel_size.get(), self.offset_x.get(), self.offset_y.get())
         
-        # Convert to RGB for tkinter
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(frame_rgb)
+        display_w, display_h = self.preview.display_size
+        scale_x = display_w / self.frames.width
+        scale_y = display_h / self.frames.height
+        self.preview.set_rectangle((x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y))
+    
+    def render_base(self, index, pixel_size, offset_x, offset_y, reducer='nearest'):
+        h, w = self.frames.height, self.frames.width
         
         # Resize image if it's too large
-        max_size = (800, 600)
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        photo = ImageTk.PhotoImage(image=img)
-        self.preview_label.configure(image=photo)
-        self.preview_label.image = photo
+        size = display_size(w, h)
+        key = ('display', index, pixel_size, offset_x, offset_y, reducer, size, self.key_settings())
+        img = self.render_cache.get(key)
+        if img is not None:
+            return img
+        
+        # Grid lines only depend on the frame size and grid settings
+        grid_key = ('grid', h, w, pixel_size, offset_x, offset_y)
+        mask = self.render_cache.get(grid_key)
+        if mask is None:
+            mask = self.render_cache.put(grid_key, grid_mask(h, w, pixel_size, offset_x, offset_y))
+        
+        # Create pixelated preview, with keyed pixels shown as they will be exported
+        frame = self.frames[index]
+        if self.key_colors:
+            frame = self.keyed_frame(frame)
+        img = render_pixelated(frame, pixel_size, offset_x, offset_y, reducer, mask, size,
+                               transparent=bool(self.key_colors))
+        return self.render_cache.put(key, img)
+    
+    def key_settings(self):
+        # Everything the keyed preview depends on, as part of the render cache key
+        if not self.key_colors:
+            return None
+        return (tuple(self.key_colors), self.tolerance.get(), self.key_metric.get(),
+                self.key_from_border.get())
+    
+    def keyed_frame(self, frame):
+        with span("mask build"):
+            keyed = key_mask(frame[..., :3], self.key_colors, self.tolerance.get(), self.key_metric.get())
+            if self.region_keyer is not None:
+                keyed = self.region_keyer.mask(keyed)
+        return keyed_bgra(frame, keyed)
+    
+    def key_changed(self):
+        self.region_keyer = RegionKeyer(BORDER_SEEDS) if self.key_from_border.get() else None
+        if self.key_colors:
+            text = " ".join("#{:02x}{:02x}{:02x}".format(*color[::-1]) for color in self.key_colors)
+        else:
+            text = "none"
+        self.key_colors_label.configure(text=f"Key colours: {text}")
+        self.update_preview()
+    
+    def start_picking(self):
+        # The next click on the preview picks a key colour instead of selecting
+        if self.frames:
+            self.is_picking = True
+            self.status_label.configure(text="Click the preview to pick a key colour")
+    
+    def pick_key_color(self, x, y):
+        self.is_picking = False
+        frame = self.frames[self.current_frame_index]
+        if not (0 <= x < frame.shape[1] and 0 <= y < frame.shape[0]):
+            return
+        color = tuple(int(channel) for channel in frame[y, x, :3])
+        if color not in self.key_colors:
+            self.key_colors.append(color)
+        self.status_label.configure(text="Ready")
+        self.key_changed()
+    
+    def clear_key_colors(self):
+        self.key_colors = []
+        self.is_picking = False
+        self.key_changed()
     
     def start_selection(self, event):
         if not self.frames:
@@ -167,12 +320,10 @@ class PixelationTool:
         self.is_selecting = True
         
         # Get actual image dimensions
-        frame = self.frames[self.current_frame_index]
-        img_h, img_w = frame.shape[:2]
+        img_h, img_w = self.frames.height, self.frames.width
         
         # Get display dimensions
-        display_w = self.preview_label.winfo_width()
-        display_h = self.preview_label.winfo_height()
+        display_w, display_h = self.preview.display_size
         
         # Calculate scaling factors
         scale_x = img_w / display_w
@@ -182,21 +333,24 @@ class PixelationTool:
         x = int(event.x * scale_x)
         y = int(event.y * scale_y)
         
+        if self.is_picking:
+            self.is_selecting = False
+            self.pick_key_color(x, y)
+            return
+        
         self.selection_start = (x, y)
         self.selection_end = (x, y)
-        self.show_frame(self.current_frame_index)
+        self.draw_selection()
     
     def update_selection(self, event):
         if not self.is_selecting or not self.frames:
             return
         
         # Get actual image dimensions
-        frame = self.frames[self.current_frame_index]
-        img_h, img_w = frame.shape[:2]
+        img_h, img_w = self.frames.height, self.frames.width
         
         # Get display dimensions
-        display_w = self.preview_label.winfo_width()
-        display_h = self.preview_label.winfo_height()
+        display_w, display_h = self.preview.display_size
         
         # Calculate scaling factors
         scale_x = img_w / display_w
@@ -211,7 +365,7 @@ class PixelationTool:
         y = max(0, min(y, img_h - 1))
         
         self.selection_end = (x, y)
-        self.show_frame(self.current_frame_index)
+        self.draw_selection()
     
     def end_selection(self, event):
         if not self.frames:
@@ -230,14 +384,23 @@ class PixelationTool:
             self.show_frame(self.current_frame_index)
     
     def animate(self):
-        if self.is_playing and self.frames:
-            self.current_frame_index = (self.current_frame_index + 1) % len(self.frames)
-            self.show_frame(self.current_frame_index)
-            self.after_id = self.root.after(100, self.animate)
+        if self.is_playing and self.frames and self.scheduler:
+            # Show whichever frame is due now; frames we fell behind on are skipped
+            index, delay = self.scheduler.tick()
+            if index != self.current_frame_index:
+                self.current_frame_index = index
+                self.show_frame(self.current_frame_index)
+            self.fps_label.configure(text=f"FPS: {self.preview.fps:.1f}  "
+                                       f"Dropped: {self.scheduler.dropped_frames}")
+            self.after_id = self.root.after(delay, self.animate)
     
     def toggle_play(self):
         self.is_playing = not self.is_playing
         if self.is_playing:
+            self.preview.reset_fps()
+            if self.scheduler:
+                self.scheduler.start(self.current_frame_index)
+                self.scheduler.reset_stats()
             self.animate()
         elif self.after_id:
             self.root.after_cancel(self.after_id)
@@ -245,96 +408,40 @@ class PixelationTool:
     def export_selection(self):
         if not self.frames or not self.selection_start or not self.selection_end:
             return
+        # Wait for the GIF to finish loading
+        if self.jobs.busy:
+            return
         
         output_path = filedialog.asksaveasfilename(defaultextension=".png",
                                                   filetypes=[("PNG files", "*.png")])
         if not output_path:
             return
         
-        pixel_size = self.pixel_size.get()
-        offset_x = self.offset_x.get()
-        offset_y = self.offset_y.get()
-        
-        # Align selection to pixel grid
-        x1 = ((self.selection_start[0] - offset_x) // pixel_size) * pixel_size + offset_x
-        y1 = ((self.selection_start[1] - offset_y) // pixel_size) * pixel_size + offset_y
-        x2 = ((self.selection_end[0] - offset_x) // pixel_size + 1) * pixel_size + offset_x
-        y2 = ((self.selection_end[1] - offset_y) // pixel_size + 1) * pixel_size + offset_y
-        
-        # Calculate selection size in pixels
-        width_pixels = (x2 - x1) // pixel_size
-        height_pixels = (y2 - y1) // pixel_size
-        
-        # Find the next power of 2 that can contain both dimensions
-        target_size = 1
-        while target_size < max(width_pixels, height_pixels):
-            target_size *= 2
-        
-        # Calculate padding needed
-        pad_width = (target_size - width_pixels) // 2
-        pad_height = (target_size - height_pixels) // 2
-        
-        # Create the final sprite sheet (target_size x (target_size * num_frames))
-        num_frames = len(self.frames)
-        sprite_sheet = np.zeros((target_size * num_frames, target_size, 4), dtype=np.uint8)
-        
-        for frame_idx, frame in enumerate(self.frames):
-            # Extract alpha channel if it exists
-            if frame.shape[2] == 4:
-                bgr, alpha = frame[:, :, :3], frame[:, :, 3]
-            else:
-                bgr, alpha = frame, np.full((frame.shape[0], frame.shape[1]), 255, dtype=np.uint8)
-            
-            # Crop the frame and alpha
-            cropped = bgr[y1:y2, x1:x2]
-            cropped_alpha = alpha[y1:y2, x1:x2]
-            
-            # Resize using nearest neighbor
-            resized = cv2.resize(cropped, (width_pixels, height_pixels), interpolation=cv2.INTER_NEAREST)
-            resized_alpha = cv2.resize(cropped_alpha, (width_pixels, height_pixels), 
-                                     interpolation=cv2.INTER_NEAREST)
-            
-            # Create square canvas with power-of-two dimensions
-            canvas = np.zeros((target_size, target_size, 3), dtype=np.uint8)
-            alpha_canvas = np.zeros((target_size, target_size), dtype=np.uint8)
-            
-            # Calculate position to place the image centered
-            start_x = pad_width
-            start_y = pad_height
-            
-            # Place the image in the center of the canvas
-            canvas[start_y:start_y + height_pixels, start_x:start_x + width_pixels] = resized
-            alpha_canvas[start_y:start_y + height_pixels, start_x:start_x + width_pixels] = resized_alpha
-            
-            # Convert to RGBA
-            frame_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
-            
-            # Create alpha mask where black pixels (0,0,0) should be transparent
-            black_mask = (frame_rgb[:, :, 0] == 0) & (frame_rgb[:, :, 1] == 0) & (frame_rgb[:, :, 2] == 0)
-            alpha_canvas[black_mask] = 0  # Set alpha to 0 (transparent) for black pixels
-            
-            frame_rgba = np.dstack((frame_rgb, alpha_canvas))
-            
-            # Place the frame in the sprite sheet
-            y_start = frame_idx * target_size
-            y_end = (frame_idx + 1) * target_size
-            sprite_sheet[y_start:y_end, :, :] = frame_rgba
-        
-        # Save as PNG
-        Image.fromarray(sprite_sheet).save(output_path)
-        
-        # Create the mcmeta file
-        mcmeta_path = output_path + ".mcmeta"
-        mcmeta_content = {
-            "animation": {
-                "frametime": 2,  # Default Minecraft frame time (2 ticks = 0.1 seconds)
-                "frames": list(range(num_frames))
-            }
-        }
-        
-        import json
-        with open(mcmeta_path, 'w') as f:
-            json.dump(mcmeta_content, f, indent=2)
+        # Export in the background so the preview keeps running
+        if self.key_colors:
+            # Key, crop and reduce in one pass; black pixels stay opaque
+            self.jobs.start("Exporting frame", export_keyed_sprite_job, self.frames, output_path,
+                            self.selection_start, self.selection_end, self.pixel_size.get(),
+                            list(self.key_colors), self.offset_x.get(), self.offset_y.get(),
+                            durations=self.frames.durations, dedupe=self.dedupe.get(),
+                            reducer=self.reducer.get(), tolerance=self.tolerance.get(),
+                            metric=self.key_metric.get(),
+                            region_seeds=BORDER_SEEDS if self.key_from_border.get() else None,
+                            indexed=self.indexed.get(), compare_png=self.indexed.get(),
+                            handlers={'done': self.export_finished})
+            return
+        self.jobs.start("Exporting frame", export_sprite_job, self.frames, output_path,
+                        self.selection_start, self.selection_end, self.pixel_size.get(),
+                        self.offset_x.get(), self.offset_y.get(), durations=self.frames.durations,
+                        dedupe=self.dedupe.get(), reducer=self.reducer.get(),
+                        indexed=self.indexed.get(), compare_png=self.indexed.get(),
+                        handlers={'done': self.export_finished})
+    
+    def export_finished(self, result):
+        num_frames, num_tiles, png_stats = result
+        self.status_label.configure(text=f"Exported {num_frames} frames as {num_tiles} tiles "
+                                         f"(dedup ratio {num_frames / max(1, num_tiles):.2f}x), "
+                                         f"{format_png_stats(png_stats)}")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,10 +1,22 @@
 import tkinter as tk
 from tkinter import filedialog, colorchooser
-from PIL import Image, ImageTk, ImageDraw
 import cv2
 import numpy as np
 from pathlib import Path
-import imageio
+
+from color_key import alpha_lut, key_lut, key_mask
+from frame_cache import default_frame_cache
+from frame_source import FrameList
+from gif_encoder import format_gif_stats
+from jobs import JobController, decode_gif_job, save_keyed_gif_job
+from playback import PlaybackScheduler
+from preview_canvas import PreviewCanvas
+from profiling import span
+from region_key import BORDER_SEEDS, RegionKeyer
+from render_cache import render_keyed
+
+KEY_MODES = ('Everywhere', 'From border', 'From clicks')
+
 
 class TransparencyTool:
     def __init__(self, root):
@@ -14,16 +26,31 @@ class TransparencyTool:
         # Variables
         self.current_gif = None
         self.frames = []
+        self.frame_cache_size = 32
+        # Decoded frames are kept on disk between sessions
+        self.frame_cache = default_frame_cache()
         self.current_frame_index = 0
         self.selected_colors = []
+        self.keyed_palettes = {}
         self.is_picking = False
+        # Key matching colours everywhere, or only regions connected to the border or
+        # to the clicked points
+        self.key_mode = tk.StringVar(value=KEY_MODES[0])
+        self.seed_points = []
+        self.region_keyer = None
+        # Also encode full frames the old way, to report what the optimized GIF saves
+        self.compare_save = tk.BooleanVar(value=False)
         
         # Create GUI elements
         self.create_widgets()
         
+        # Decoding and saving run on worker threads
+        self.jobs = JobController(self.root, lambda text: self.status_label.config(text=text))
+        
         # Animation control
         self.is_playing = False
         self.after_id = None
+        self.scheduler = None
         
     def create_widgets(self):
         # Upload button
@@ -34,11 +61,11 @@ class TransparencyTool:
         self.preview_frame = tk.Frame(self.root, width=400, height=400)
         self.preview_frame.pack(pady=10)
         
-        self.preview_label = tk.Label(self.preview_frame)
-        self.preview_label.pack()
-        self.preview_label.bind('<Button-1>', self.start_picking)
-        self.preview_label.bind('<B1-Motion>', self.pick_color_from_image)
-        self.preview_label.bind('<ButtonRelease-1>', self.stop_picking)
+        # Persistent canvas; frames are pasted into its image in place
+        self.preview = PreviewCanvas(self.preview_frame)
+        self.preview.bind('<Button-1>', self.start_picking)
+        self.preview.bind('<B1-Motion>', self.pick_color_from_image)
+        self.preview.bind('<ButtonRelease-1>', self.stop_picking)
         
         # Color selection
         self.color_frame = tk.Frame(self.root)
@@ -51,92 +78,130 @@ class TransparencyTool:
         self.clear_colors_btn = tk.Button(self.color_frame, text="Clear Colors", command=self.clear_colors)
         self.clear_colors_btn.pack(side=tk.LEFT, padx=5)
         
+        tk.Label(self.color_frame, text="Key:").pack(side=tk.LEFT)
+        self.key_mode_menu = tk.OptionMenu(self.color_frame, self.key_mode, *KEY_MODES,
+                                           command=self.key_mode_changed)
+        self.key_mode_menu.pack(side=tk.LEFT, padx=5)
+        
         # Save button
         self.save_btn = tk.Button(self.root, text="Save Transparent GIF", command=self.save_gif)
         self.save_btn.pack(pady=5)
         
+        self.compare_check = tk.Checkbutton(self.root, text="Compare with full-frame GIF",
+                                            variable=self.compare_save)
+        self.compare_check.pack()
+        
         # Animation controls
         self.control_frame = tk.Frame(self.root)
         self.control_frame.pack(pady=5)
         
         self.play_btn = tk.Button(self.control_frame, text="Play/Pause", command=self.toggle_play)
         self.play_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Cancel the running load or save
+        self.cancel_btn = tk.Button(self.control_frame, text="Cancel", command=self.cancel_job)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Sustained playback rate
+        self.fps_label = tk.Label(self.control_frame, text="FPS: -")
+        self.fps_label.pack(side=tk.LEFT, padx=5)
+        
+        # Background job status
+        self.status_label = tk.Label(self.root, text="Ready")
+        self.status_label.pack(pady=5)
     
     def upload_gif(self):
         file_path = filedialog.askopenfilename(filetypes=[("GIF files", "*.gif")])
         if file_path:
-            self.frames = []
-            gif = imageio.get_reader(file_path)
+            # Stop playback of the previous file while the new one loads
+            self.is_playing = False
+            self.scheduler = None
+            if self.after_id:
+                self.root.after_cancel(self.after_id)
             
-            for frame in gif:
-                # Convert to BGR for OpenCV
-                frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                self.frames.append(frame_bgr)
-            
-            self.current_frame_index = 0
-            self.show_frame(self.current_frame_index)
-            self.is_playing = True
-            self.animate()
+            # Decode in the background; the first frame is shown as soon as it is ready
+            self.jobs.start("Loading frame", decode_gif_job, file_path, 'BGR', self.frame_cache_size,
+                            self.frame_cache, handlers={'first_frame': self.show_first_frame, 'done': self.gif_loaded})
+    
+    def show_first_frame(self, frame):
+        self.set_frames(FrameList([frame]))
+    
+    def gif_loaded(self, frames):
+        # Frames are decoded on demand as BGR for OpenCV
+        self.set_frames(frames)
+        self.scheduler = PlaybackScheduler(self.frames.durations)
+        
+        self.is_playing = True
+        self.scheduler.start(self.current_frame_index)
+        self.animate()
+    
+    def set_frames(self, frames):
+        if self.frames:
+            self.frames.close()
+        self.frames = frames
+        self.invalidate_key_mask()
+        
+        self.current_frame_index = 0
+        self.show_frame(self.current_frame_index)
+    
+    def cancel_job(self):
+        self.jobs.cancel()
     
     def show_frame(self, index):
         if not self.frames:
             return
+        
+        with span("show_frame"):
+            # Paletted frames are keyed per palette entry and converted to RGB and alpha
+            # with a table lookup each; frames held as pixels are keyed per pixel
+            entry = self.frames.native_indexed(index)
+            with span("mask build"):
+                if entry is not None:
+                    indices, palette = entry
+                    rgb_palette, alpha_palette = self.keyed_palette(index, palette)
+                    frame_rgb = rgb_palette[indices]
+                    alpha = alpha_palette[indices]
+                else:
+                    frame = self.frames[index]
+                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    alpha = alpha_lut(key_mask(frame, self.selected_colors))
+                if self.region_keyer is not None:
+                    # Only the matching pixels connected to the seeds become transparent
+                    alpha = alpha_lut(self.region_keyer.mask(alpha == 0))
+            
+            # Composite over a cached checkerboard to show transparency, resized if needed
+            bg_img = render_keyed(frame_rgb, alpha)
             
-        frame = self.frames[index].copy()
-        
-        # Create alpha channel for preview
-        alpha = np.ones((frame.shape[0], frame.shape[1]), dtype=np.uint8) * 255
-        
-        # Apply transparency to selected colors
-        for color in self.selected_colors:
-            # Add tolerance to color matching
-            lower_bound = np.array([max(0, c - 5) for c in color])
-            upper_bound = np.array([min(255, c + 5) for c in color])
-            mask = cv2.inRange(frame, lower_bound, upper_bound)
-            alpha[mask > 0] = 0  # Set alpha to transparent where colors match
-        
-        # Convert to RGBA for preview
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame_rgba = np.dstack((frame_rgb, alpha))
-        
-        # Convert to PIL Image with transparency
-        img = Image.fromarray(frame_rgba, 'RGBA')
-        
-        # Create checkerboard background to show transparency
-        bg_size = 20  # Size of checkerboard squares
-        bg_color1 = (200, 200, 200)  # Light gray
-        bg_color2 = (150, 150, 150)  # Dark gray
-        bg_img = Image.new('RGBA', img.size, (0, 0, 0, 0))
-        dc = ImageDraw.Draw(bg_img)
-        
-        for i in range(0, img.width, bg_size):
-            for j in range(0, img.height, bg_size):
-                color = bg_color1 if ((i + j) // bg_size) % 2 == 0 else bg_color2
-                dc.rectangle([i, j, i + bg_size, j + bg_size], fill=color)
-        
-        # Composite the image over the checkerboard background
-        bg_img.paste(img, (0, 0), img)
-        
-        # Resize if needed
-        max_size = (800, 600)
-        bg_img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Create a new photo image
-        photo = ImageTk.PhotoImage(image=bg_img)
-        
-        # Destroy old label and create a new one
-        self.preview_label.destroy()
-        self.preview_label = tk.Label(self.preview_frame)
-        self.preview_label.pack()
-        
-        # Rebind the events
-        self.preview_label.bind('<Button-1>', self.start_picking)
-        self.preview_label.bind('<B1-Motion>', self.pick_color_from_image)
-        self.preview_label.bind('<ButtonRelease-1>', self.stop_picking)
-        
-        # Set the new image
-        self.preview_label.configure(image=photo)
-        self.preview_label.image = photo
+            # Update the preview image in place
+            self.preview.show(bg_img)
+    
+    def keyed_palette(self, index, palette):
+        # RGB and alpha palettes with selected colors transparent, rebuilt only when the
+        # selection changes
+        keyed = self.keyed_palettes.get(index)
+        if keyed is None:
+            lut = key_lut(palette, self.selected_colors)
+            keyed = (np.ascontiguousarray(palette[:, ::-1]), alpha_lut(lut))
+            self.keyed_palettes[index] = keyed
+        return keyed
+    
+    def invalidate_key_mask(self):
+        self.keyed_palettes = {}
+        seeds = self.region_seeds()
+        self.region_keyer = RegionKeyer(seeds) if seeds is not None else None
+    
+    def region_seeds(self):
+        mode = self.key_mode.get()
+        if mode == 'From border':
+            return BORDER_SEEDS
+        if mode == 'From clicks':
+            return list(self.seed_points)
+        return None
+    
+    def key_mode_changed(self, _mode):
+        self.invalidate_key_mask()
+        self.update_selected_colors_label()
+        self.show_frame(self.current_frame_index)
     
     def start_picking(self, event):
         self.is_picking = True
@@ -149,7 +214,6 @@ class TransparencyTool:
         if not self.frames or not self.is_picking:
             return
         
-        # Get current frame
         frame = self.frames[self.current_frame_index]
         
         # Get click coordinates
@@ -157,13 +221,11 @@ class TransparencyTool:
         y = event.y
         
         # Check if coordinates are within image bounds
-        if hasattr(self.preview_label, 'image') and self.preview_label.image:
-            img = self.frames[self.current_frame_index]
-            height, width = img.shape[:2]
+        if self.preview.has_image:
+            height, width = frame.shape[:2]
             
             # Scale coordinates if image was resized
-            display_width = self.preview_label.winfo_width()
-            display_height = self.preview_label.winfo_height()
+            display_width, display_height = self.preview.display_size
             
             x_scale = width / display_width
             y_scale = height / display_height
@@ -173,31 +235,52 @@ class TransparencyTool:
             
             if 0 <= x < width and 0 <= y < height:
                 # Get color at clicked position
-                color = frame[y, x].tolist()  # BGR format
+                color = frame[y, x, :3].tolist()  # BGR format
                 
-                # Add color if not already in list
+                # Add color if not already in list; in click mode the point also seeds a region
+                changed = False
                 if color not in self.selected_colors:
                     self.selected_colors.append(color)
+                    changed = True
+                if self.key_mode.get() == 'From clicks' and (x, y) not in self.seed_points:
+                    self.seed_points.append((x, y))
+                    changed = True
+                if changed:
+                    self.invalidate_key_mask()
                     self.update_selected_colors_label()
                     self.show_frame(self.current_frame_index)
     
     def clear_colors(self):
         self.selected_colors = []
+        self.seed_points = []
+        self.invalidate_key_mask()
         self.update_selected_colors_label()
         self.show_frame(self.current_frame_index)
     
     def update_selected_colors_label(self):
-        self.selected_colors_label.config(text=f"Selected colors: {self.selected_colors}")
+        text = f"Selected colors: {self.selected_colors}"
+        if self.key_mode.get() == 'From clicks':
+            text += f", {len(self.seed_points)} seed point(s)"
+        self.selected_colors_label.config(text=text)
     
     def animate(self):
-        if self.is_playing and self.frames:
-            self.current_frame_index = (self.current_frame_index + 1) % len(self.frames)
-            self.show_frame(self.current_frame_index)
-            self.after_id = self.root.after(100, self.animate)
+        if self.is_playing and self.frames and self.scheduler:
+            # Show whichever frame is due now; frames we fell behind on are skipped
+            index, delay = self.scheduler.tick()
+            if index != self.current_frame_index:
+                self.current_frame_index = index
+                self.show_frame(self.current_frame_index)
+            self.fps_label.config(text=f"FPS: {self.preview.fps:.1f}  "
+                                       f"Dropped: {self.scheduler.dropped_frames}")
+            self.after_id = self.root.after(delay, self.animate)
     
     def toggle_play(self):
         self.is_playing = not self.is_playing
         if self.is_playing:
+            self.preview.reset_fps()
+            if self.scheduler:
+                self.scheduler.start(self.current_frame_index)
+                self.scheduler.reset_stats()
             self.animate()
         elif self.after_id:
             self.root.after_cancel(self.after_id)
@@ -205,28 +288,21 @@ class TransparencyTool:
     def save_gif(self):
         if not self.frames:
             return
+        # Wait for the GIF to finish loading
+        if self.jobs.busy:
+            return
             
         output_path = filedialog.asksaveasfilename(defaultextension=".gif",
                                                   filetypes=[("GIF files", "*.gif")])
         if output_path:
-            processed_frames = []
-            
-            for frame in self.frames:
-                processed_frame = frame.copy()
-                
-                # Set transparent pixels to black
-                for color in self.selected_colors:
-                    lower_bound = np.array([max(0, c - 5) for c in color])
-                    upper_bound = np.array([min(255, c + 5) for c in color])
-                    mask = cv2.inRange(processed_frame, lower_bound, upper_bound)
-                    processed_frame[mask > 0] = [0, 0, 0]  # Set to black
-                
-                # Convert to RGB
-                processed_frame = cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB)
-                processed_frames.append(processed_frame)
-            
-            # Save the processed GIF
-            imageio.mimsave(output_path, processed_frames, format='GIF', duration=0.1)
+            # Save in the background so the preview keeps running
+            self.jobs.start("Saving frame", save_keyed_gif_job, self.frames, output_path,
+                            list(self.selected_colors), durations=self.frames.durations,
+                            compare=self.compare_save.get(), region_seeds=self.region_seeds(),
+                            handlers={'done': self.save_finished})
+    
+    def save_finished(self, stats):
+        self.status_label.config(text=f"Saved: {format_gif_stats(stats)}")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,90 @@
+import numpy as np
+
+from profiling import span
+
+
+def _pack_pixels(stack):
+    # (N, H, W, C) uint8 -> (N, H, W) uint32 so a colour change is one comparison
+    if stack.shape[-1] == 4 and stack.flags.c_contiguous:
+        return stack.view(np.uint32)[..., 0]
+    packed = np.zeros(stack.shape[:-1], dtype=np.uint32)
+    for channel in range(stack.shape[-1]):
+        packed |= stack[..., channel].astype(np.uint32) << (8 * channel)
+    return packed
+
+
+def edge_histograms(frames, max_frames=64, chunk_size=64, on_progress=None):
+    # Count, for every column and row boundary, how often the colour changes across it.
+    # Boundary b lies between pixels b - 1 and b. Up to max_frames frames, spread evenly
+    # over the whole animation, are analysed (all of them when max_frames is None).
+    # Frames are read in one iteration pass, which GifFrameSource serves from its own
+    # file handle, so this is safe to run while the preview reads the same source
+    num_frames = len(frames)
+    if max_frames is not None and num_frames > max_frames:
+        sampled = set(np.linspace(0, num_frames - 1, max_frames).round().astype(int).tolist())
+    else:
+        sampled = None
+
+    hist_x = hist_y = None
+    chunk = []
+    done = 0
+
+    def flush():
+        nonlocal done
+        packed = _pack_pixels(np.stack(chunk))
+        hist_x[1:] += np.count_nonzero(packed[:, :, 1:] != packed[:, :, :-1], axis=(0, 1))
+        hist_y[1:] += np.count_nonzero(packed[:, 1:] != packed[:, :-1], axis=(0, 2))
+        done += len(chunk)
+        chunk.clear()
+        if on_progress is not None:
+            on_progress(done)
+
+    for index, frame in enumerate(frames):
+        if sampled is not None and index not in sampled:
+            continue
+        if hist_x is None:
+            hist_x = np.zeros(frame.shape[1], dtype=np.int64)
+            hist_y = np.zeros(frame.shape[0], dtype=np.int64)
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    return hist_x, hist_y
+
+
+def _best_phase(hist, pitch):
+    # Edge count on the strongest phase of a pitch, and that phase
+    phase_counts = np.bincount(np.arange(len(hist)) % pitch, weights=hist, minlength=pitch)
+    phase = int(phase_counts.argmax())
+    return phase_counts[phase], phase
+
+
+def estimate_grid(hist_x, hist_y, max_pitch=None, min_share=0.9):
+    # In upscaled pixel art every colour change sits on a grid line, so the pitch is
+    # the largest one whose best phase still collects min_share of all edges. Multiples
+    # of the real pitch only collect a fraction of them. Returns (pixel_size, offset_x,
+    # offset_y), or None when no pitch of 2 or more fits
+    total = hist_x.sum() + hist_y.sum()
+    if total == 0:
+        return None
+    if max_pitch is None:
+        max_pitch = min(len(hist_x), len(hist_y)) // 2
+
+    for pitch in range(max_pitch, 1, -1):
+        captured_x, offset_x = _best_phase(hist_x, pitch)
+        captured_y, offset_y = _best_phase(hist_y, pitch)
+        if captured_x + captured_y >= min_share * total:
+            return pitch, offset_x, offset_y
+    return None
+
+
+def detect_grid(frames, max_frames=64, max_pitch=None, min_share=0.9, on_progress=None):
+    # Pixel size and grid offsets of pixel art that was upscaled by an integer factor,
+    # estimated from the colour-change histograms of the frames
+    with span("grid detect"):
+        hist_x, hist_y = edge_histograms(frames, max_frames, on_progress=on_progress)
+        if hist_x is None:
+            return None
+        return estimate_grid(hist_x, hist_y, max_pitch, min_share)
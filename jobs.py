@@ -0,0 +1,226 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from frame_cache import open_frames
+from frame_source import decode_frame
+from gif_encoder import save_optimized_gif
+from grid_detect import detect_grid
+from profiling import span
+from sprite_export import export_keyed_sprite_sheet, export_sprite_sheet
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # Handle shared by a running task and whoever started it. The task reports
+    # events through a queue and checks the cancel flag between units of work;
+    # the owner drains the queue from its own thread.
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.finished = threading.Event()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, kind, payload=None):
+        self.events.put((kind, payload))
+
+    def progress(self, done, total=None):
+        self.check_cancelled()
+        self.report('progress', (done, total))
+
+
+def _run(job, func, args, kwargs):
+    try:
+        # Jobs are the whole of loading, exporting and saving, so each gets a span
+        with span(func.__name__):
+            result = func(job, *args, **kwargs)
+    except JobCancelled:
+        job.report('cancelled')
+    except Exception as e:
+        job.report('error', e)
+    else:
+        job.report('done', result)
+    finally:
+        job.finished.set()
+
+
+class JobRunner:
+    # Runs job functions (func(job, *args, **kwargs)) on a small thread pool
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, func, *args, **kwargs):
+        job = Job()
+        self.executor.submit(_run, job, func, args, kwargs)
+        return job
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def dispatch_events(job, handlers):
+    # Deliver queued events to handlers keyed by event kind
+    while True:
+        try:
+            kind, payload = job.events.get_nowait()
+        except queue.Empty:
+            return
+        handler = handlers.get(kind)
+        if handler is not None:
+            handler(payload)
+
+
+def poll_job(root, job, handlers, interval=30):
+    # Drain job events on the Tk thread with root.after until the job finishes
+    finished = job.finished.is_set()
+    dispatch_events(job, handlers)
+    if not finished:
+        root.after(interval, poll_job, root, job, handlers, interval)
+
+
+class JobController:
+    # Runs one job at a time on behalf of a Tk window. Events are delivered on the
+    # Tk thread, and events from a job that has since been replaced are dropped.
+
+    def __init__(self, root, on_status, runner=None):
+        self.root = root
+        self.on_status = on_status
+        self.runner = runner or JobRunner()
+        self.current_job = None
+
+    @property
+    def busy(self):
+        return self.current_job is not None
+
+    def start(self, description, func, *args, handlers=None, **kwargs):
+        self.cancel()
+        job = self.runner.submit(func, *args, **kwargs)
+        self.current_job = job
+        self.on_status(description)
+
+        handlers = dict(handlers or {})
+        on_done = handlers.pop('done', None)
+        events = {
+            'progress': lambda progress: self._show_progress(description, progress),
+            'done': lambda result: self._finish("Ready", on_done, result),
+            'error': lambda error: self._finish(f"Error: {error}"),
+            'cancelled': lambda _: self._finish("Cancelled"),
+        }
+        events.update(handlers)
+
+        def guarded(handler):
+            def call(payload):
+                if job is self.current_job:
+                    handler(payload)
+            return call
+
+        poll_job(self.root, job, {kind: guarded(handler) for kind, handler in events.items()})
+        return job
+
+    def cancel(self):
+        if self.current_job is not None:
+            self.current_job.cancel()
+            self.current_job = None
+            self.on_status("Cancelled")
+
+    def _show_progress(self, description, progress):
+        done, total = progress
+        self.on_status(f"{description} {done}/{total}" if total else f"{description} {done}")
+
+    def _finish(self, message, callback=None, result=None):
+        self.current_job = None
+        self.on_status(message)
+        if callback is not None:
+            callback(result)
+
+
+def run_job(func, *args, handlers=None, **kwargs):
+    # Run a job function synchronously, for scripts and batch workers. Returns the
+    # result and re-raises failures, dispatching other events to handlers
+    job = Job()
+    _run(job, func, args, kwargs)
+
+    result = None
+    error = None
+    while not job.events.empty():
+        kind, payload = job.events.get_nowait()
+        if kind == 'done':
+            result = payload
+        elif kind == 'error':
+            error = payload
+        elif kind == 'cancelled':
+            error = JobCancelled()
+        if handlers and kind in handlers:
+            handlers[kind](payload)
+    if error is not None:
+        raise error
+    return result
+
+
+def decode_gif_job(job, file_path, mode='BGRA', cache_size=32, frame_cache=None):
+    # Hand the first frame over as soon as it is decoded, then scan the rest
+    with Image.open(file_path) as gif:
+        first_frame = decode_frame(gif, mode)
+    job.report('first_frame', first_frame)
+
+    return open_frames(file_path, mode=mode, cache_size=cache_size, frame_cache=frame_cache,
+                       on_progress=lambda count: job.progress(count))
+
+
+def detect_grid_job(job, frames, max_frames=64):
+    total = min(len(frames), max_frames) if max_frames is not None else len(frames)
+    return detect_grid(frames, max_frames, on_progress=lambda done: job.progress(done, total))
+
+
+def _frames_with_progress(job, frames, total):
+    for index, frame in enumerate(frames):
+        job.progress(index, total)
+        yield frame
+    job.progress(total, total)
+
+
+def export_sprite_job(job, frames, output_path, selection_start, selection_end, pixel_size,
+                      offset_x=0, offset_y=0, durations=None, dedupe=False, reducer='nearest',
+                      **png_options):
+    # Streams the frames into the sheet, reporting progress and honouring cancellation.
+    # png_options are passed on to export_sprite_sheet
+    total = len(frames)
+    return export_sprite_sheet(_frames_with_progress(job, frames, total), output_path,
+                               selection_start, selection_end, pixel_size, offset_x, offset_y,
+                               num_frames=total, durations=durations, dedupe=dedupe, reducer=reducer,
+                               **png_options)
+
+
+def export_keyed_sprite_job(job, frames, output_path, selection_start, selection_end, pixel_size, colors,
+                            offset_x=0, offset_y=0, durations=None, dedupe=False, reducer='nearest',
+                            tolerance=5, metric='box', region_seeds=None, **png_options):
+    # export_sprite_job that keys the colours out on the way, in the same single pass
+    total = len(frames)
+    return export_keyed_sprite_sheet(_frames_with_progress(job, frames, total), output_path,
+                                     selection_start, selection_end, pixel_size, colors, offset_x, offset_y,
+                                     tolerance, metric, region_seeds, num_frames=total, durations=durations,
+                                     dedupe=dedupe, reducer=reducer, **png_options)
+
+
+def save_keyed_gif_job(job, frames, output_path, colors, durations=None, compare=False, region_seeds=None):
+    total = len(frames)
+    return save_optimized_gif(frames, output_path, colors, durations,
+                              progress=lambda done: job.progress(done, total), compare=compare,
+                              region_seeds=region_seeds)
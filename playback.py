@@ -0,0 +1,62 @@
+import time
+
+
+class PlaybackScheduler:
+    # Plays frames against a monotonic clock using each frame's own duration. Frame
+    # start times are accumulated from the durations rather than from when a frame
+    # was actually drawn, so slow renders never stretch the animation; frames whose
+    # whole slot passed before they could be shown are skipped and counted as dropped.
+
+    def __init__(self, durations, clock=time.monotonic):
+        if not durations:
+            raise ValueError("Cannot schedule playback without frames")
+        # Durations in milliseconds, never zero so the timeline always advances
+        self.durations = [max(1, duration) / 1000 for duration in durations]
+        self.total_duration = sum(self.durations)
+        self.clock = clock
+
+        self.index = 0
+        self.frame_start = None
+        self.dropped_frames = 0
+        self.shown_frames = 0
+
+    def start(self, index=0):
+        # (Re)start the timeline with the given frame on screen now
+        self.index = index % len(self.durations)
+        self.frame_start = self.clock()
+
+    def tick(self):
+        # Returns the frame that should be on screen now and the delay in milliseconds
+        # until the next frame is due
+        if self.frame_start is None:
+            self.start(self.index)
+
+        now = self.clock()
+        num_frames = len(self.durations)
+        skipped = -1
+
+        # After a long stall jump over whole loops instead of walking every frame
+        behind = now - self.frame_start
+        if behind > self.total_duration:
+            loops = int(behind // self.total_duration)
+            self.frame_start += loops * self.total_duration
+            self.dropped_frames += loops * num_frames
+
+        next_start = self.frame_start + self.durations[self.index]
+        while now >= next_start:
+            self.index = (self.index + 1) % num_frames
+            self.frame_start = next_start
+            next_start += self.durations[self.index]
+            skipped += 1
+
+        if skipped > 0:
+            self.dropped_frames += skipped
+        if skipped >= 0:
+            self.shown_frames += 1
+
+        delay = max(1, int(round((next_start - now) * 1000)))
+        return self.index, delay
+
+    def reset_stats(self):
+        self.dropped_frames = 0
+        self.shown_frames = 0
@@ -0,0 +1,154 @@
+import io
+import os
+import time
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from profiling import span
+
+# zlib strategies Pillow can use for the PNG data stream. PNG row filters are chosen
+# by the encoder: adaptive for RGBA and none for indexed images, as the spec advises
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+MAX_PALETTE_COLORS = 256
+
+# Load Pillow's common codecs now, so encode timings do not include plugin imports
+Image.preinit()
+
+
+def _pack_rgba(rgba):
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    return rgba.view(np.uint32).reshape(rgba.shape[:-1])
+
+
+def _unpack_rgba(packed):
+    return np.ascontiguousarray(packed, dtype=np.uint32).view(np.uint8).reshape(-1, 4)
+
+
+def _canonical_transparent(rgba):
+    # Every fully transparent pixel becomes (0, 0, 0, 0) so they share one palette entry
+    if (rgba[..., 3] == 0).any() and rgba[..., :3][rgba[..., 3] == 0].any():
+        rgba = rgba.copy()
+        rgba[rgba[..., 3] == 0] = 0
+    return rgba
+
+
+def _order_palette(colors):
+    # Palette from distinct packed colours. Entries with alpha below 255 come first
+    # so the tRNS chunk stays short
+    colors = _unpack_rgba(colors)
+    return colors[np.argsort(colors[:, 3] == 255, kind='stable')]
+
+
+def rgba_palette(rgba):
+    # Distinct colours of an RGBA image as a (K, 4) palette
+    return _order_palette(np.unique(_pack_rgba(_canonical_transparent(rgba))))
+
+
+def merge_palettes(palettes):
+    # One palette holding every colour of the given palettes
+    palettes = [palette for palette in palettes if len(palette)]
+    if not palettes:
+        return np.zeros((0, 4), dtype=np.uint8)
+    return _order_palette(np.unique(np.concatenate([_pack_rgba(palette) for palette in palettes])))
+
+
+def quantize_rgba(rgba, palette=None):
+    # Map an RGBA image onto a palette: returns (indices, palette, lossy). Without a
+    # palette the image's own colours are used, falling back to a lossy 256 colour
+    # octree quantization when there are more of them
+    rgba = _canonical_transparent(rgba)
+    packed = _pack_rgba(rgba)
+
+    if palette is None:
+        colors, indices = np.unique(packed.ravel(), return_inverse=True)
+        if len(colors) > MAX_PALETTE_COLORS:
+            quantized = Image.fromarray(rgba, 'RGBA').quantize(MAX_PALETTE_COLORS,
+                                                               method=Image.Quantize.FASTOCTREE)
+            palette = np.array(quantized.getpalette('RGBA'), dtype=np.uint8).reshape(-1, 4)
+            return np.array(quantized), palette, True
+        palette = _order_palette(colors)
+        remap = np.empty(len(colors), dtype=np.uint8)
+        remap[np.searchsorted(colors, _pack_rgba(palette))] = np.arange(len(palette), dtype=np.uint8)
+        return remap[indices].reshape(rgba.shape[:2]), palette, False
+
+    if len(palette) > MAX_PALETTE_COLORS:
+        raise ValueError(f"Palette has {len(palette)} colours, PNG allows {MAX_PALETTE_COLORS}")
+    palette_packed = _pack_rgba(palette)
+    order = np.argsort(palette_packed)
+    positions = np.searchsorted(palette_packed[order], packed).clip(0, len(palette) - 1)
+    indices = order[positions]
+    if not np.array_equal(palette_packed[indices], packed):
+        raise ValueError("Image has colours missing from the shared palette")
+    return indices.astype(np.uint8), palette, False
+
+
+def encode_png(rgba, output, indexed=False, palette=None, compress_level=None, strategy='default'):
+    # Save an RGBA image as PNG to a path or file object, either as RGBA or as an
+    # indexed image with a tRNS chunk. Returns size and timing statistics
+    save_options = {}
+    if compress_level is not None:
+        save_options['compress_level'] = compress_level
+    if strategy != 'default':
+        save_options['compress_type'] = PNG_STRATEGIES[strategy]
+
+    start = time.perf_counter()
+    stats = {"colors": None, "lossy": False}
+    if indexed:
+        with span("quantize"):
+            indices, palette, stats["lossy"] = quantize_rgba(rgba, palette)
+        img = Image.fromarray(indices, 'P')
+        img.putpalette(palette[:, :3].tobytes())
+        stats["colors"] = len(palette)
+
+        # tRNS holds alpha up to the last non-opaque entry; the rest are opaque
+        translucent = np.flatnonzero(palette[:, 3] < 255)
+        if len(translucent):
+            save_options['transparency'] = palette[:translucent[-1] + 1, 3].tobytes()
+        with span("PNG encode"):
+            img.save(output, format='PNG', **save_options)
+    else:
+        with span("PNG encode"):
+            Image.fromarray(rgba).save(output, format='PNG', **save_options)
+    stats["encode_time"] = time.perf_counter() - start
+
+    if isinstance(output, (str, os.PathLike)):
+        stats["bytes"] = os.path.getsize(output)
+    else:
+        stats["bytes"] = output.tell()
+    return stats
+
+
+def save_sheet_png(rgba, output_path, indexed=False, palette=None, compress_level=None,
+                   png_strategy='default', compare_png=False):
+    # Write the sheet and, with compare_png, also encode it the default way (RGBA,
+    # Pillow defaults) in memory so the savings can be reported
+    stats = encode_png(rgba, output_path, indexed, palette, compress_level, png_strategy)
+    if compare_png:
+        baseline = encode_png(rgba, io.BytesIO())
+        stats["baseline_bytes"] = baseline["bytes"]
+        stats["baseline_encode_time"] = baseline["encode_time"]
+    return stats
+
+
+def format_png_stats(stats):
+    # One line summary, with savings when a baseline was measured
+    text = f"PNG {stats['bytes'] / 1024:.1f} KB in {stats['encode_time'] * 1000:.1f} ms"
+    if stats.get("colors") is not None:
+        text += f", {stats['colors']} colours" + (" (lossy)" if stats.get("lossy") else "")
+    if stats.get("baseline_bytes"):
+        size_change = stats["bytes"] / stats["baseline_bytes"] - 1
+        time_change = stats["encode_time"] / max(stats["baseline_encode_time"], 1e-9) - 1
+        text += (f"; RGBA {stats['baseline_bytes'] / 1024:.1f} KB in "
+                 f"{stats['baseline_encode_time'] * 1000:.1f} ms "
+                 f"({abs(size_change):.0%} {'smaller' if size_change <= 0 else 'larger'}, "
+                 f"{abs(time_change):.0%} {'less' if time_change <= 0 else 'more'} encode time)")
+    return text
@@ -0,0 +1,70 @@
+import time
+import tkinter as tk
+from collections import deque
+
+from PIL import ImageTk
+
+from profiling import span
+
+
+class PreviewCanvas:
+    # Canvas holding a single image item that is updated in place. The PhotoImage
+    # buffer is only recreated when the preview size changes; otherwise new frames
+    # are pasted into it, so playback never rebuilds or re-packs widgets.
+
+    def __init__(self, parent, fps_window=60):
+        self.canvas = tk.Canvas(parent, width=1, height=1, borderwidth=0, highlightthickness=0)
+        self.canvas.pack()
+
+        self.photo = None
+        self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW)
+        self.rectangle_item = None
+
+        # Presentation timestamps for the sustained frame rate
+        self.frame_times = deque(maxlen=fps_window)
+
+    def bind(self, sequence, func):
+        self.canvas.bind(sequence, func)
+
+    def show(self, img):
+        if self.photo is None or (self.photo.width(), self.photo.height()) != img.size:
+            with span("PhotoImage create"):
+                self.photo = ImageTk.PhotoImage(image=img)
+            self.canvas.itemconfigure(self.image_item, image=self.photo)
+            self.canvas.configure(width=img.width, height=img.height)
+        else:
+            with span("PhotoImage paste"):
+                self.photo.paste(img)
+        self.frame_times.append(time.perf_counter())
+
+    def set_rectangle(self, coords, color='red', width=2):
+        # Overlay rectangle drawn as a canvas item, so moving it needs no image render
+        if coords is None:
+            if self.rectangle_item is not None:
+                self.canvas.delete(self.rectangle_item)
+                self.rectangle_item = None
+            return
+        if self.rectangle_item is None:
+            self.rectangle_item = self.canvas.create_rectangle(*coords, outline=color, width=width)
+        else:
+            self.canvas.coords(self.rectangle_item, *coords)
+
+    @property
+    def has_image(self):
+        return self.photo is not None
+
+    @property
+    def display_size(self):
+        if self.photo is None:
+            return 0, 0
+        return self.photo.width(), self.photo.height()
+
+    @property
+    def fps(self):
+        if len(self.frame_times) < 2:
+            return 0.0
+        elapsed = self.frame_times[-1] - self.frame_times[0]
+        return (len(self.frame_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def reset_fps(self):
+        self.frame_times.clear()
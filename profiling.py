@@ -0,0 +1,156 @@
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+# GIF_TOOLS_PROFILE=1 prints a timing summary on exit; GIF_TOOLS_TRACE=path also writes
+# the spans as Chrome trace JSON (chrome://tracing or Perfetto)
+PROFILE_ENV = 'GIF_TOOLS_PROFILE'
+TRACE_ENV = 'GIF_TOOLS_TRACE'
+
+_enabled = False
+_trace_path = None
+_report_registered = False
+# (name, start ns, duration ns, pid, thread id); list.append is atomic, so worker
+# threads record without a lock
+_records = []
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        _records.append((self.name, self.start, time.perf_counter_ns() - self.start,
+                         os.getpid(), threading.get_ident()))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    # Time a block: with span("decode"): ... When profiling is off this returns one
+    # shared do-nothing context manager, so instrumented code pays a flag check
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(trace_path=None):
+    # Start recording. The settings go into the environment too, so worker processes
+    # started afterwards record as well; only the main process reports on exit
+    global _enabled, _trace_path, _report_registered
+    _enabled = True
+    _trace_path = trace_path or _trace_path
+    os.environ[PROFILE_ENV] = '1'
+    if _trace_path:
+        os.environ[TRACE_ENV] = _trace_path
+    if not _report_registered and multiprocessing.parent_process() is None:
+        atexit.register(_report_at_exit)
+        _report_registered = True
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Print a timing summary of the processing stages on exit "
+                             f"(or set {PROFILE_ENV}=1)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="Also write the timing spans to PATH as Chrome trace JSON")
+
+
+def enable_from_args(args):
+    if args.profile or args.trace:
+        enable(args.trace)
+
+
+def run_profiled(func, *args, **kwargs):
+    # Process pool entry point: returns func's result together with the spans it
+    # recorded, for collect() in the parent. A forked worker starts with a copy of the
+    # parent's spans, so only the new ones are sent back
+    start = len(_records)
+    result = func(*args, **kwargs)
+    records = _records[start:]
+    del _records[start:]
+    return result, records
+
+
+def collect(profiled_result):
+    # Merge the spans of a run_profiled result and return the plain result
+    result, records = profiled_result
+    _records.extend(records)
+    return result
+
+
+def _percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summary_rows(records=None):
+    # (name, count, total ms, p50 ms, p95 ms), slowest stage first
+    durations = {}
+    for name, _, duration, _, _ in (_records if records is None else records):
+        durations.setdefault(name, []).append(duration / 1e6)
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append((name, len(values), sum(values), _percentile(values, 0.5), _percentile(values, 0.95)))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+
+def format_summary(records=None):
+    rows = summary_rows(records)
+    width = max([len(row[0]) for row in rows] + [4])
+    lines = [f"{'span':<{width}} {'count':>7} {'total ms':>10} {'p50 ms':>9} {'p95 ms':>9}"]
+    for name, count, total, p50, p95 in rows:
+        lines.append(f"{name:<{width}} {count:>7} {total:>10.1f} {p50:>9.2f} {p95:>9.2f}")
+    return "\n".join(lines)
+
+
+def write_chrome_trace(path, records=None):
+    # Complete ("X") events with microsecond timestamps, one track per process and thread
+    events = [{"name": name, "cat": "gif_tools", "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+               "pid": pid, "tid": tid}
+              for name, start, duration, pid, tid in (_records if records is None else records)]
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _report_at_exit():
+    if not _records:
+        return
+    print("\nProfile:", file=sys.stderr)
+    print(format_summary(), file=sys.stderr)
+    if _trace_path:
+        write_chrome_trace(_trace_path)
+        print(f"Trace written to {_trace_path}", file=sys.stderr)
+
+
+if os.environ.get(PROFILE_ENV, '') not in ('', '0') or os.environ.get(TRACE_ENV):
+    enable(os.environ.get(TRACE_ENV))
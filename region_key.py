@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+
+# Where region keying starts: the frame border, or points picked by the user
+BORDER_SEEDS = 'border'
+
+
+def _seed_labels(labels, seeds):
+    if seeds == BORDER_SEEDS:
+        return np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]])
+    height, width = labels.shape
+    points = [(x, y) for x, y in seeds if 0 <= x < width and 0 <= y < height]
+    if not points:
+        return np.zeros(0, dtype=labels.dtype)
+    xs, ys = np.array(points).T
+    return labels[ys, xs]
+
+
+def connected_key_mask(keyable, seeds=BORDER_SEEDS, connectivity=4):
+    # Pixels of the keyable mask connected to a seed: the border, or (x, y) points.
+    # One labelling pass handles every seed, where flood filling would need one fill
+    # per seed
+    count, labels = cv2.connectedComponents(keyable.view(np.uint8), connectivity=connectivity)
+    selected = np.zeros(count, dtype=bool)
+    selected[_seed_labels(labels, seeds)] = True
+    selected[0] = False  # label 0 is everything not keyable
+    return selected[labels]
+
+
+class RegionKeyer:
+    # Connected-region keying over the frames of an animation. Only key-coloured
+    # regions reachable from the seeds become transparent, so sprite pixels that
+    # happen to match the background stay opaque. Usually only a small part of a
+    # frame changes, and often none of the keyable pixels do (opaque sprite pixels
+    # changing colour, held frames); then the previous frame's mask is reused instead
+    # of labelling again. Connectivity is global, so any change to the keyable
+    # pixels means relabelling the frame.
+
+    def __init__(self, seeds=BORDER_SEEDS, connectivity=4):
+        self.seeds = seeds
+        self.connectivity = connectivity
+        self.previous_keyable = None
+        self.previous_mask = None
+        self.reused = 0
+        self.computed = 0
+
+    def mask(self, keyable):
+        # keyable: (H, W) bool of pixels matching a key colour
+        if self.previous_keyable is not None and np.array_equal(keyable, self.previous_keyable):
+            self.reused += 1
+            return self.previous_mask
+        mask = connected_key_mask(keyable, self.seeds, self.connectivity)
+        self.previous_keyable = keyable
+        self.previous_mask = mask
+        self.computed += 1
+        return mask
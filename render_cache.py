@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from block_reduce import reduce_blocks
+from profiling import span
+
+
+def value_nbytes(value):
+    # Approximate memory held by a cached layer
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    raise TypeError(f"Cannot size cached value of type {type(value).__name__}")
+
+
+class RenderCache:
+    # LRU cache for rendered preview layers, bounded by the total size of its values
+    # rather than by entry count so large frames cannot exhaust memory
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        nbytes = value_nbytes(value)
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+
+        # Values larger than the whole budget are returned but never stored
+        if nbytes > self.max_bytes:
+            return value
+
+        self._entries[key] = (value, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+
+def display_size(width, height, max_size=(800, 600)):
+    # Size the preview fits into, never upscaling (same rule as Image.thumbnail)
+    scale = min(1.0, max_size[0] / width, max_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def pixelate_frame(frame, pixel_size, offset_x, offset_y, reducer='nearest'):
+    with span("pixelate"):
+        return _pixelate_frame(frame, pixel_size, offset_x, offset_y, reducer)
+
+
+def _pixelate_frame(frame, pixel_size, offset_x, offset_y, reducer):
+    h, w = frame.shape[:2]
+
+    # Calculate new dimensions
+    new_h = (h - offset_y) // pixel_size
+    new_w = (w - offset_x) // pixel_size
+
+    pixelated = frame.copy()
+    if new_w <= 0 or new_h <= 0:
+        return pixelated
+
+    # Reduce each block to one pixel (the top-left one for 'nearest') and blow it back up
+    blocks = reduce_blocks(frame[offset_y:offset_y + new_h * pixel_size,
+                                 offset_x:offset_x + new_w * pixel_size], pixel_size, reducer)
+    pixelated[offset_y:offset_y + new_h * pixel_size,
+              offset_x:offset_x + new_w * pixel_size] = cv2.resize(
+        blocks, (new_w * pixel_size, new_h * pixel_size), interpolation=cv2.INTER_NEAREST)
+    return pixelated
+
+
+def grid_mask(height, width, pixel_size, offset_x, offset_y):
+    # Boolean mask of the one pixel wide grid lines
+    mask = np.zeros((height, width), dtype=bool)
+    mask[:, offset_x::pixel_size] = True
+    mask[offset_y::pixel_size, :] = True
+    return mask
+
+
+@lru_cache(maxsize=8)
+def checkerboard(width, height, tile_size=20, color1=(200, 200, 200), color2=(150, 150, 150)):
+    # RGB checkerboard shown behind transparent pixels, built once per size
+    pattern = np.empty((2 * tile_size, 2 * tile_size, 3), dtype=np.uint8)
+    pattern[:] = color1
+    pattern[:tile_size, tile_size:] = color2
+    pattern[tile_size:, :tile_size] = color2
+
+    reps_y = height // (2 * tile_size) + 1
+    reps_x = width // (2 * tile_size) + 1
+    board = np.ascontiguousarray(np.tile(pattern, (reps_y, reps_x, 1))[:height, :width])
+    # Shared between callers, so make accidental writes fail loudly
+    board.flags.writeable = False
+    return board
+
+
+def composite_keyed(rgb, alpha, background):
+    # Copy pixels with non-zero alpha over a copy of the background. Colour keying
+    # only produces fully opaque or fully transparent pixels, so no blending is needed
+    return cv2.copyTo(rgb, alpha, background.copy())
+
+
+def render_pixelated(frame, pixel_size, offset_x, offset_y, reducer, grid, size, transparent=False):
+    # Pixelation tool preview: the pixelated BGR(A) frame with the grid mask drawn in
+    # green, as an RGB image scaled to size. transparent shows pixels of a BGRA frame
+    # with zero alpha as a checkerboard
+    frame = pixelate_frame(frame, pixel_size, offset_x, offset_y, reducer)
+    with span("grid overlay"):
+        frame[grid, :3] = (0, 255, 0)
+        if transparent:
+            frame[grid, 3] = 255
+
+    # Convert to RGB for tkinter
+    with span("colour conversion"):
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if transparent:
+        with span("composite"):
+            h, w = frame_rgb.shape[:2]
+            frame_rgb = composite_keyed(frame_rgb, frame[..., 3], checkerboard(w, h))
+    img = Image.fromarray(frame_rgb)
+    if img.size != size:
+        with span("thumbnail"):
+            img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def render_keyed(rgb, alpha, max_size=(800, 600)):
+    # Transparency tool preview: keyed pixels show a checkerboard, scaled down to
+    # fit max_size
+    with span("composite"):
+        h, w = rgb.shape[:2]
+        img = Image.fromarray(composite_keyed(rgb, alpha, checkerboard(w, h)))
+    with span("thumbnail"):
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return img
@@ -0,0 +1,416 @@
+import hashlib
+import json
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from block_reduce import reduce_blocks
+from color_key import key_mask, keyed_bgra
+from frame_source import GifFrameSource
+from png_output import save_sheet_png
+from profiling import span
+from region_key import RegionKeyer
+
+
+def load_gif_frames(file_path):
+    # Decode every frame up front; prefer GifFrameSource for large files
+    source = GifFrameSource(file_path, cache_size=0)
+    try:
+        return list(source)
+    finally:
+        source.close()
+
+
+def align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y):
+    # Snap the selection corners outwards to the pixel grid
+    x1 = ((selection_start[0] - offset_x) // pixel_size) * pixel_size + offset_x
+    y1 = ((selection_start[1] - offset_y) // pixel_size) * pixel_size + offset_y
+    x2 = ((selection_end[0] - offset_x) // pixel_size + 1) * pixel_size + offset_x
+    y2 = ((selection_end[1] - offset_y) // pixel_size + 1) * pixel_size + offset_y
+    return x1, y1, x2, y2
+
+
+def full_frame_selection(frame_shape, pixel_size, offset_x, offset_y):
+    # Selection covering every complete pixel block of the frame
+    h, w = frame_shape[:2]
+    new_w = (w - offset_x) // pixel_size
+    new_h = (h - offset_y) // pixel_size
+    if new_w <= 0 or new_h <= 0:
+        raise ValueError("Frame is smaller than a single pixel block")
+    selection_start = (offset_x, offset_y)
+    selection_end = (offset_x + (new_w - 1) * pixel_size, offset_y + (new_h - 1) * pixel_size)
+    return selection_start, selection_end
+
+
+def next_power_of_two(value):
+    target_size = 1
+    while target_size < value:
+        target_size *= 2
+    return target_size
+
+
+def build_sprite_sheet(frames, selection_start, selection_end, pixel_size, offset_x=0, offset_y=0,
+                       batched=True, num_frames=None, reducer='nearest'):
+    # Lists and arrays are processed in memory; any other iterable (a GifFrameSource or
+    # a generator) is consumed in a single streaming pass. reducer picks how each pixel
+    # block becomes one sprite pixel (see block_reduce.REDUCERS)
+    if not isinstance(frames, (list, tuple, np.ndarray)):
+        return _build_sprite_sheet_streaming(frames, selection_start, selection_end, pixel_size,
+                                             offset_x, offset_y, num_frames, reducer)
+    if batched:
+        x1, y1, x2, y2 = align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y)
+        h, w = frames[0].shape[:2]
+        if _selection_inside(x1, y1, x2, y2, w, h):
+            return _build_sprite_sheet_batched(frames, (x1, y1, x2, y2), pixel_size, reducer)
+    if reducer != 'nearest':
+        return _build_sprite_sheet_streaming(frames, selection_start, selection_end, pixel_size,
+                                             offset_x, offset_y, len(frames), reducer)
+    return _build_sprite_sheet_loop(frames, selection_start, selection_end, pixel_size,
+                                    offset_x, offset_y)
+
+
+def extract_tiles(frames, selection_start, selection_end, pixel_size, offset_x=0, offset_y=0,
+                  num_frames=None, reducer='nearest'):
+    # Unpadded RGBA tiles of shape (N, height_pixels, width_pixels, 4)
+    sprite_sheet, num_frames = build_sprite_sheet(frames, selection_start, selection_end, pixel_size,
+                                                  offset_x, offset_y, num_frames=num_frames,
+                                                  reducer=reducer)
+    x1, y1, x2, y2 = align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y)
+    width_pixels, height_pixels, target_size, pad_width, pad_height = _sheet_layout(
+        x1, y1, x2, y2, pixel_size)
+    tiles = sprite_sheet.reshape(num_frames, target_size, target_size, 4)
+    return np.ascontiguousarray(tiles[:, pad_height:pad_height + height_pixels,
+                                      pad_width:pad_width + width_pixels])
+
+
+def _selection_inside(x1, y1, x2, y2, w, h):
+    # The strided slice only matches INTER_NEAREST when the selection lies inside the frame
+    return 0 <= x1 and 0 <= y1 and x2 <= w and y2 <= h
+
+
+def _padded_crop(frame, x1, y1, x2, y2):
+    # Crop that may extend past the frame edges; the outside reads as transparent black
+    h, w = frame.shape[:2]
+    crop = np.zeros((y2 - y1, x2 - x1) + frame.shape[2:], dtype=frame.dtype)
+    src_x1, src_y1 = max(x1, 0), max(y1, 0)
+    src_x2, src_y2 = min(x2, w), min(y2, h)
+    if src_x1 < src_x2 and src_y1 < src_y2:
+        crop[src_y1 - y1:src_y2 - y1, src_x1 - x1:src_x2 - x1] = frame[src_y1:src_y2, src_x1:src_x2]
+    return crop
+
+
+def _sheet_layout(x1, y1, x2, y2, pixel_size):
+    # Calculate selection size in pixels
+    width_pixels = (x2 - x1) // pixel_size
+    height_pixels = (y2 - y1) // pixel_size
+
+    # Find the next power of 2 that can contain both dimensions
+    target_size = next_power_of_two(max(width_pixels, height_pixels))
+
+    # Calculate padding needed
+    pad_width = (target_size - width_pixels) // 2
+    pad_height = (target_size - height_pixels) // 2
+    return width_pixels, height_pixels, target_size, pad_width, pad_height
+
+
+def _build_sprite_sheet_batched(frames, aligned_selection, pixel_size, reducer='nearest'):
+    x1, y1, x2, y2 = aligned_selection
+    width_pixels, height_pixels, target_size, pad_width, pad_height = _sheet_layout(
+        x1, y1, x2, y2, pixel_size)
+
+    # Nearest-neighbour downsampling by an integer factor keeps the top-left pixel of
+    # every block, so a strided slice over the whole (N, H, W, C) stack does the resize;
+    # the other reducers reshape the same stack into blocks and reduce them in one pass
+    if isinstance(frames, np.ndarray):
+        blocks = reduce_blocks(frames[:, y1:y2, x1:x2], pixel_size, reducer)
+    else:
+        blocks = np.stack([reduce_blocks(frame[y1:y2, x1:x2], pixel_size, reducer) for frame in frames])
+
+    # Write straight into the tiles of a preallocated sheet
+    num_frames = blocks.shape[0]
+    sprite_sheet = np.zeros((target_size * num_frames, target_size, 4), dtype=np.uint8)
+    tiles = sprite_sheet.reshape(num_frames, target_size, target_size, 4)
+    _write_tiles(tiles[:, pad_height:pad_height + height_pixels, pad_width:pad_width + width_pixels],
+                 blocks)
+
+    return sprite_sheet, num_frames
+
+
+def _write_tiles(tiles, blocks, black_transparent=True):
+    # BGR(A) -> RGBA, works on a single tile or a whole stack
+    tiles[..., :3] = blocks[..., 2::-1]
+    if blocks.shape[-1] == 4:
+        tiles[..., 3] = blocks[..., 3]
+    else:
+        tiles[..., 3] = 255
+
+    # Black pixels (0,0,0) are transparent, unless the alpha is already real
+    if black_transparent:
+        tiles[..., 3][~tiles[..., :3].any(axis=-1)] = 0
+
+
+def _build_sprite_sheet_streaming(frames, selection_start, selection_end, pixel_size, offset_x, offset_y,
+                                  num_frames=None, reducer='nearest'):
+    if num_frames is None:
+        if not hasattr(frames, '__len__'):
+            # Unknown length, so buffer the frames and use the in-memory path
+            return build_sprite_sheet(list(frames), selection_start, selection_end, pixel_size,
+                                      offset_x, offset_y, reducer=reducer)
+        num_frames = len(frames)
+
+    x1, y1, x2, y2 = align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y)
+    width_pixels, height_pixels, target_size, pad_width, pad_height = _sheet_layout(
+        x1, y1, x2, y2, pixel_size)
+
+    # Only the output sheet and the frame being decoded are held in memory
+    sprite_sheet = np.zeros((target_size * num_frames, target_size, 4), dtype=np.uint8)
+    tiles = sprite_sheet.reshape(num_frames, target_size, target_size, 4)
+
+    frame_idx = -1
+    for frame_idx, frame in enumerate(frames):
+        if frame_idx >= num_frames:
+            raise ValueError(f"Frame source yielded more than {num_frames} frames")
+
+        h, w = frame.shape[:2]
+        if _selection_inside(x1, y1, x2, y2, w, h) or reducer != 'nearest':
+            if _selection_inside(x1, y1, x2, y2, w, h):
+                crop = frame[y1:y2, x1:x2]
+            else:
+                crop = _padded_crop(frame, x1, y1, x2, y2)
+            _write_tiles(tiles[frame_idx, pad_height:pad_height + height_pixels,
+                               pad_width:pad_width + width_pixels],
+                         reduce_blocks(crop, pixel_size, reducer))
+        else:
+            tiles[frame_idx] = _build_sprite_sheet_loop([frame], selection_start, selection_end,
+                                                        pixel_size, offset_x, offset_y)[0]
+
+    # Trim the sheet if the source ended early
+    num_frames = frame_idx + 1
+    return sprite_sheet[:target_size * num_frames], num_frames
+
+
+def _build_sprite_sheet_loop(frames, selection_start, selection_end, pixel_size, offset_x=0, offset_y=0):
+    # Align selection to pixel grid
+    x1, y1, x2, y2 = align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y)
+
+    width_pixels, height_pixels, target_size, pad_width, pad_height = _sheet_layout(
+        x1, y1, x2, y2, pixel_size)
+
+    # Create the final sprite sheet (target_size x (target_size * num_frames))
+    num_frames = len(frames)
+    sprite_sheet = np.zeros((target_size * num_frames, target_size, 4), dtype=np.uint8)
+
+    for frame_idx, frame in enumerate(frames):
+        # Extract alpha channel if it exists
+        if frame.shape[2] == 4:
+            bgr, alpha = frame[:, :, :3], frame[:, :, 3]
+        else:
+            bgr, alpha = frame, np.full((frame.shape[0], frame.shape[1]), 255, dtype=np.uint8)
+
+        # Crop the frame and alpha
+        cropped = bgr[y1:y2, x1:x2]
+        cropped_alpha = alpha[y1:y2, x1:x2]
+
+        # Resize using nearest neighbor
+        resized = cv2.resize(cropped, (width_pixels, height_pixels), interpolation=cv2.INTER_NEAREST)
+        resized_alpha = cv2.resize(cropped_alpha, (width_pixels, height_pixels),
+                                   interpolation=cv2.INTER_NEAREST)
+
+        # Create square canvas with power-of-two dimensions
+        canvas = np.zeros((target_size, target_size, 3), dtype=np.uint8)
+        alpha_canvas = np.zeros((target_size, target_size), dtype=np.uint8)
+
+        # Place the image in the center of the canvas
+        canvas[pad_height:pad_height + height_pixels, pad_width:pad_width + width_pixels] = resized
+        alpha_canvas[pad_height:pad_height + height_pixels, pad_width:pad_width + width_pixels] = resized_alpha
+
+        # Convert to RGBA
+        frame_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
+
+        # Create alpha mask where black pixels (0,0,0) should be transparent
+        black_mask = (frame_rgb[:, :, 0] == 0) & (frame_rgb[:, :, 1] == 0) & (frame_rgb[:, :, 2] == 0)
+        alpha_canvas[black_mask] = 0  # Set alpha to 0 (transparent) for black pixels
+
+        frame_rgba = np.dstack((frame_rgb, alpha_canvas))
+
+        # Place the frame in the sprite sheet
+        y_start = frame_idx * target_size
+        y_end = (frame_idx + 1) * target_size
+        sprite_sheet[y_start:y_end, :, :] = frame_rgba
+
+    return sprite_sheet, num_frames
+
+
+def _keyed_blocks(frame, x1, y1, x2, y2, pixel_size, reducer, colors, tolerance, metric, keyer=None):
+    # BGRA blocks of the aligned selection with keyed pixels transparent black. Only
+    # the part of the frame under the selection is keyed; the rest reads as transparent
+    h, w = frame.shape[:2]
+    src_x1, src_y1 = max(x1, 0), max(y1, 0)
+    src_x2, src_y2 = min(x2, w), min(y2, h)
+    if src_x1 >= src_x2 or src_y1 >= src_y2:
+        return reduce_blocks(np.zeros((y2 - y1, x2 - x1, 4), dtype=np.uint8), pixel_size, reducer)
+    inner = frame[src_y1:src_y2, src_x1:src_x2]
+
+    if keyer is not None:
+        # Regions are connected over the whole frame, not just the selection
+        with span("mask build"):
+            keyed = keyer.mask(key_mask(frame[..., :3], colors, tolerance, metric))
+        crop = keyed_bgra(inner, keyed[src_y1:src_y2, src_x1:src_x2])
+    elif reducer == 'nearest' and _selection_inside(x1, y1, x2, y2, w, h):
+        # Keying commutes with picking the top-left pixel of each block, so key the
+        # sampled pixels only
+        blocks = reduce_blocks(inner, pixel_size, reducer)
+        with span("mask build"):
+            keyed = key_mask(blocks[..., :3], colors, tolerance, metric)
+        return keyed_bgra(blocks, keyed)
+    else:
+        with span("mask build"):
+            keyed = key_mask(inner[..., :3], colors, tolerance, metric)
+        crop = keyed_bgra(inner, keyed)
+
+    if not _selection_inside(x1, y1, x2, y2, w, h):
+        crop = _padded_crop(crop, x1 - src_x1, y1 - src_y1, x2 - src_x1, y2 - src_y1)
+    return reduce_blocks(crop, pixel_size, reducer)
+
+
+def build_keyed_sprite_sheet(frames, selection_start, selection_end, pixel_size, colors, offset_x=0,
+                             offset_y=0, tolerance=5, metric='box', region_seeds=None, num_frames=None,
+                             reducer='nearest'):
+    # Colour keying and sprite sheet assembly in one pass over BGR(A) frames. Keyed
+    # pixels get alpha 0 (region_seeds limits them to connected regions, see
+    # region_key), the source alpha is kept, and every other pixel stays opaque, black
+    # included. Replaces saving a keyed GIF with black for transparency and exporting
+    # that again
+    if num_frames is None:
+        if not hasattr(frames, '__len__'):
+            frames = list(frames)
+        num_frames = len(frames)
+
+    x1, y1, x2, y2 = align_selection(selection_start, selection_end, pixel_size, offset_x, offset_y)
+    width_pixels, height_pixels, target_size, pad_width, pad_height = _sheet_layout(
+        x1, y1, x2, y2, pixel_size)
+    keyer = RegionKeyer(region_seeds) if region_seeds is not None else None
+
+    sprite_sheet = np.zeros((target_size * num_frames, target_size, 4), dtype=np.uint8)
+    tiles = sprite_sheet.reshape(num_frames, target_size, target_size, 4)
+
+    frame_idx = -1
+    for frame_idx, frame in enumerate(frames):
+        if frame_idx >= num_frames:
+            raise ValueError(f"Frame source yielded more than {num_frames} frames")
+        blocks = _keyed_blocks(frame, x1, y1, x2, y2, pixel_size, reducer, colors, tolerance, metric,
+                               keyer)
+        _write_tiles(tiles[frame_idx, pad_height:pad_height + height_pixels,
+                           pad_width:pad_width + width_pixels], blocks, black_transparent=False)
+
+    # Trim the sheet if the source ended early
+    num_frames = frame_idx + 1
+    return sprite_sheet[:target_size * num_frames], num_frames
+
+
+# Minecraft animations advance in game ticks of 50 ms
+MINECRAFT_TICK_MS = 50
+
+
+def durations_to_ticks(durations):
+    return [max(1, round(duration / MINECRAFT_TICK_MS)) for duration in durations]
+
+
+def dedupe_tiles(sprite_sheet, target_size):
+    # Keep only the first occurrence of each distinct tile. Returns the reduced sheet
+    # and, for every source frame, the index of its tile in that sheet
+    num_frames = sprite_sheet.shape[0] // target_size
+    tiles = sprite_sheet.reshape(num_frames, target_size, target_size, 4)
+
+    tile_indices = {}
+    unique_frames = []
+    frame_tiles = []
+    for frame_idx in range(num_frames):
+        digest = hashlib.blake2b(tiles[frame_idx].tobytes(), digest_size=16).digest()
+        tile_idx = tile_indices.get(digest)
+        if tile_idx is None:
+            tile_idx = tile_indices[digest] = len(unique_frames)
+            unique_frames.append(frame_idx)
+        frame_tiles.append(tile_idx)
+
+    return tiles[unique_frames].reshape(-1, target_size, 4), frame_tiles
+
+
+def write_mcmeta(output_path, num_frames, durations=None, frame_tiles=None):
+    mcmeta_path = output_path + ".mcmeta"
+
+    # Default Minecraft frame time (2 ticks = 0.1 seconds) unless the source timing is known
+    ticks = durations_to_ticks(durations[:num_frames]) if durations is not None else [2] * num_frames
+    if frame_tiles is None:
+        frame_tiles = range(num_frames)
+
+    # Consecutive frames showing the same tile become one longer entry
+    entries = []
+    for tile_idx, time in zip(frame_tiles, ticks):
+        if entries and entries[-1][0] == tile_idx:
+            entries[-1][1] += time
+        else:
+            entries.append([tile_idx, time])
+
+    # Use the most common time as frametime and give other entries their own time
+    frametime = Counter(time for _, time in entries).most_common(1)[0][0] if entries else 2
+    mcmeta_content = {
+        "animation": {
+            "frametime": frametime,
+            "frames": [index if time == frametime else {"index": index, "time": time}
+                       for index, time in entries]
+        }
+    }
+
+    with span(".mcmeta write"), open(mcmeta_path, 'w') as f:
+        json.dump(mcmeta_content, f, indent=2)
+    return mcmeta_path
+
+
+def export_sprite_sheet(frames, output_path, selection_start, selection_end, pixel_size,
+                        offset_x=0, offset_y=0, batched=True, num_frames=None, durations=None,
+                        dedupe=False, reducer='nearest', indexed=False, palette=None, compress_level=None,
+                        png_strategy='default', compare_png=False):
+    # Returns (num_frames, num_tiles, png_stats). indexed writes a palette PNG with a
+    # tRNS chunk, using palette when given (e.g. one shared by a whole batch)
+    with span("sprite sheet"):
+        sprite_sheet, num_frames = build_sprite_sheet(frames, selection_start, selection_end,
+                                                      pixel_size, offset_x, offset_y, batched,
+                                                      num_frames, reducer)
+    return _save_sprite_sheet(sprite_sheet, num_frames, output_path, durations, dedupe, indexed, palette,
+                              compress_level, png_strategy, compare_png)
+
+
+def export_keyed_sprite_sheet(frames, output_path, selection_start, selection_end, pixel_size, colors,
+                              offset_x=0, offset_y=0, tolerance=5, metric='box', region_seeds=None,
+                              num_frames=None, durations=None, dedupe=False, reducer='nearest',
+                              indexed=False, palette=None, compress_level=None, png_strategy='default',
+                              compare_png=False):
+    # export_sprite_sheet with colour keying done on the way (see build_keyed_sprite_sheet)
+    with span("sprite sheet"):
+        sprite_sheet, num_frames = build_keyed_sprite_sheet(frames, selection_start, selection_end,
+                                                            pixel_size, colors, offset_x, offset_y,
+                                                            tolerance, metric, region_seeds, num_frames,
+                                                            reducer)
+    return _save_sprite_sheet(sprite_sheet, num_frames, output_path, durations, dedupe, indexed, palette,
+                              compress_level, png_strategy, compare_png)
+
+
+def _save_sprite_sheet(sprite_sheet, num_frames, output_path, durations, dedupe, indexed, palette,
+                       compress_level, png_strategy, compare_png):
+    # Store each distinct tile once and reference it from the .mcmeta frame list
+    frame_tiles = None
+    num_tiles = num_frames
+    if dedupe and num_frames:
+        with span("dedupe"):
+            sprite_sheet, frame_tiles = dedupe_tiles(sprite_sheet, sprite_sheet.shape[1])
+        num_tiles = sprite_sheet.shape[0] // sprite_sheet.shape[1]
+
+    # Save as PNG
+    png_stats = save_sheet_png(sprite_sheet, output_path, indexed, palette, compress_level,
+                               png_strategy, compare_png)
+
+    # Create the mcmeta file
+    write_mcmeta(output_path, num_frames, durations, frame_tiles)
+    return num_frames, num_tiles, png_stats